@@ -0,0 +1,367 @@
+from migrate import Migrate, mapping_entries
+from utils.logger import log
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from rich.progress import Progress
+import json
+import os
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+# Seconds a worker keeps an entry without renewing its lease
+LEASE_TIMEOUT = 60
+# Attempts per entry before the coordinator gives up on it
+MAX_ATTEMPTS = 3
+# Consecutive failed requests before a worker stops waiting for the coordinator
+MAX_UNREACHABLE = 12
+# Seconds an idle worker waits before asking for a lease again
+POLL_INTERVAL = 2
+
+
+class Coordinator:
+    """
+    Own the mapping queue and lease its entries to workers over HTTP.
+
+    Protocol (JSON bodies):
+      POST /lease    {"worker"}                         -> 200 entry + lease, 204 nothing yet, 410 all done
+      POST /renew    {"lease", "progress"}              -> 200, 409 when the lease was reassigned
+      POST /complete {"lease", "success", "error"}      -> 200, 409 when the lease was reassigned
+      GET  /status                                      -> 200 aggregated progress
+    """
+
+    def __init__(self, migration: Migrate, address="0.0.0.0:80"):
+        self.migration = migration
+        self.config = migration.config
+        host, _, port = address.rpartition(":")
+        self.address = (host or "0.0.0.0", int(port))
+        self.lease_timeout = int(self.config.get(
+            "cluster", {}).get("leaseTimeout", LEASE_TIMEOUT))
+
+        self.lock = threading.Lock()
+        self.entries = dict(mapping_entries(self.config.get("mapping", [])))
+        self.pending = deque(self.entries.keys())
+        self.leases = {}
+        self.attempts = {name: 0 for name in self.entries}
+        self.progress = {name: 0 for name in self.entries}
+        self.done = set()
+        self.failed = set()
+        # Workers that polled for a lease, and those told the migration finished
+        self.workers = set()
+        self.released = set()
+
+    """
+    Hand the next pending entry to a worker
+    """
+
+    def lease(self, worker):
+        with self.lock:
+            self.workers.add(worker)
+            if not self.pending:
+                return None
+            name = self.pending.popleft()
+            lease = uuid.uuid4().hex
+            self.attempts[name] += 1
+            self.progress[name] = 0
+            self.leases[lease] = {
+                "name": name,
+                "worker": worker,
+                "expires": time.monotonic() + self.lease_timeout,
+            }
+            log.info(
+                f"[{name}] Leased to {worker} (attempt {self.attempts[name]})")
+            return {"lease": lease, "name": name, "timeout": self.lease_timeout, **self.entries[name]}
+
+    """
+    Extend a lease and record the progress reported by its worker
+    """
+
+    def renew(self, lease, progress):
+        with self.lock:
+            if lease not in self.leases:
+                return False
+            self.leases[lease]["expires"] = time.monotonic() + self.lease_timeout
+            self.progress[self.leases[lease]["name"]] = progress
+            return True
+
+    """
+    Release a lease once its worker finished the entry
+    """
+
+    def complete(self, lease, success, error=None):
+        with self.lock:
+            if lease not in self.leases:
+                return False
+            info = self.leases.pop(lease)
+            name = info["name"]
+            if success:
+                self.done.add(name)
+                self.progress[name] = 100
+                log.info(f"[{name}] Completed by {info['worker']}")
+            else:
+                self.retry(name, f"failed on {info['worker']}: {error}")
+            return True
+
+    """
+    Requeue an entry, or mark it failed once it ran out of attempts (lock must be held)
+    """
+
+    def retry(self, name, reason):
+        if self.attempts[name] >= MAX_ATTEMPTS:
+            self.failed.add(name)
+            log.error(f"[{name}] Giving up after {self.attempts[name]} attempts: {reason}")
+        else:
+            self.pending.appendleft(name)
+            log.warning(f"[{name}] Requeued: {reason}")
+
+    """
+    Requeue the entries of workers that stopped renewing their lease
+    """
+
+    def reap(self):
+        with self.lock:
+            now = time.monotonic()
+            for lease, info in list(self.leases.items()):
+                if info["expires"] < now:
+                    del self.leases[lease]
+                    self.retry(info["name"], f"lease of {info['worker']} expired")
+
+    def finished(self):
+        with self.lock:
+            return len(self.done) + len(self.failed) == len(self.entries)
+
+    def release(self, worker):
+        with self.lock:
+            self.released.add(worker)
+
+    """
+    Keep answering 410 until every worker saw it, a worker that lost its lease learns it within a lease timeout
+    and an idle one polls within POLL_INTERVAL, so only dead workers make it wait until the deadline
+    """
+
+    def linger(self):
+        deadline = time.monotonic() + self.lease_timeout + POLL_INTERVAL
+        while time.monotonic() < deadline:
+            with self.lock:
+                if self.workers <= self.released:
+                    return
+                waiting = sorted(self.workers - self.released)
+            log.debug(f"Waiting for {', '.join(waiting)} to poll the coordinator")
+            time.sleep(1)
+
+    def status(self):
+        with self.lock:
+            return {
+                "total": len(self.entries),
+                "done": sorted(self.done),
+                "failed": sorted(self.failed),
+                "pending": list(self.pending),
+                "running": {info["name"]: info["worker"] for info in self.leases.values()},
+                "progress": dict(self.progress),
+            }
+
+    def handler(self):
+        coordinator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def reply(self, code, body=None):
+                payload = json.dumps(body).encode() if body is not None else b""
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if self.path == "/status":
+                    self.reply(200, coordinator.status())
+                else:
+                    self.reply(404, {"error": "not found"})
+
+            def do_POST(self):
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    self.reply(400, {"error": "invalid json"})
+                    return
+
+                if self.path == "/lease":
+                    worker = body.get("worker", self.client_address[0])
+                    entry = coordinator.lease(worker)
+                    if entry:
+                        self.reply(200, entry)
+                    elif coordinator.finished():
+                        self.reply(410, {"error": "migration finished"})
+                        coordinator.release(worker)
+                    else:
+                        self.reply(204)
+                elif self.path == "/renew":
+                    ok = coordinator.renew(body.get("lease"), body.get("progress", 0))
+                    self.reply(200 if ok else 409, {"ok": ok})
+                elif self.path == "/complete":
+                    ok = coordinator.complete(body.get("lease"), body.get(
+                        "success", False), body.get("error"))
+                    self.reply(200 if ok else 409, {"ok": ok})
+                else:
+                    self.reply(404, {"error": "not found"})
+
+            def log_message(self, format, *args):
+                log.debug(f"Coordinator {self.address_string()} - {format % args}")
+
+        return Handler
+
+    """
+    Serve the mapping queue until every entry is done or failed
+    """
+
+    def run(self):
+        if not self.entries:
+            log.error(
+                "No mapping found in configuration please use --mapping option to provide mapping")
+            exit(1)
+
+        server = ThreadingHTTPServer(self.address, self.handler())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        log.info(
+            f"Coordinator listening on {self.address[0]}:{self.address[1]} with {len(self.entries)} entries")
+
+        try:
+            with Progress() as progress:
+                tasks = {name: progress.add_task(
+                    f"[cyan]Migration {name} pending", total=100) for name in self.entries}
+                while not self.finished():
+                    self.reap()
+                    status = self.status()
+                    for name, task in tasks.items():
+                        state = "done" if name in status["done"] else "failed" if name in status[
+                            "failed"] else f"on {status['running'][name]}" if name in status["running"] else "pending"
+                        progress.update(
+                            task, description=f"[cyan]Migration {name} {state}", completed=status["progress"][name])
+                    time.sleep(1)
+            self.linger()
+        finally:
+            server.shutdown()
+
+        if self.failed:
+            log.error(f"Migration failed for {', '.join(sorted(self.failed))}")
+            exit(1)
+        log.info("All entries migrated")
+
+
+class Worker:
+    """
+    Lease mapping entries from a coordinator and migrate them locally.
+    """
+
+    def __init__(self, migration: Migrate, url, worker_id=None):
+        self.migration = migration
+        self.url = url.rstrip("/")
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+
+    def request(self, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(f"{self.url}{path}", data=data, headers={
+                                     "Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=30) as response:
+                payload = response.read()
+                return response.status, json.loads(payload) if payload else None
+        except urllib.error.HTTPError as e:
+            payload = e.read()
+            return e.code, json.loads(payload) if payload else None
+
+    """
+    Renew the lease periodically until stopped, reporting the latest progress.
+    Set cancel once the lease is lost so the transfer stops before the entry is migrated twice.
+    """
+
+    def heartbeat(self, entry, state, stop, cancel):
+        renewed = time.monotonic()
+        while not stop.wait(entry["timeout"] / 3):
+            try:
+                code, _ = self.request(
+                    "/renew", {"lease": entry["lease"], "progress": state["progress"]})
+            except OSError as e:
+                log.warning(f"[{entry['name']}] Failed to renew lease: {e}")
+                if time.monotonic() - renewed >= entry["timeout"]:
+                    # The coordinator reassigns the entry once the lease expired
+                    log.warning(
+                        f"[{entry['name']}] Lease expired without renewal, cancelling the transfer")
+                    cancel.set()
+                    return
+                continue
+            if code == 409:
+                log.warning(
+                    f"[{entry['name']}] Lease lost, the coordinator reassigned this entry, cancelling the transfer")
+                cancel.set()
+                return
+            renewed = time.monotonic()
+
+    """
+    Migrate a leased entry while keeping its lease alive
+    """
+
+    def process(self, entry):
+        state = {"progress": 0}
+        stop = threading.Event()
+        cancel = threading.Event()
+        heartbeat = threading.Thread(
+            target=self.heartbeat, args=(entry, state, stop, cancel), daemon=True)
+        heartbeat.start()
+        success, error = False, None
+        try:
+            self.migration.migrate_entry(entry["name"], entry, callback=lambda percent: state.update(
+                progress=percent), cancel=cancel)
+            success = True
+        except SystemExit as e:
+            # migrate_rsync exits on failure, report it instead of stopping the worker
+            error = f"exit code {e.code}"
+        except Exception as e:
+            error = str(e)
+        finally:
+            stop.set()
+            heartbeat.join()
+        if cancel.is_set():
+            # The entry belongs to another worker now
+            return
+        try:
+            self.request("/complete", {"lease": entry["lease"],
+                         "success": success, "error": error})
+        except OSError as e:
+            log.warning(
+                f"[{entry['name']}] Failed to report completion, the lease will expire: {e}")
+
+    """
+    Process entries until the coordinator reports the migration finished
+    """
+
+    def run(self):
+        log.info(f"Worker {self.worker_id} connecting to {self.url}")
+        failures = 0
+        while True:
+            try:
+                code, entry = self.request("/lease", {"worker": self.worker_id})
+                failures = 0
+            except OSError as e:
+                failures += 1
+                if failures >= MAX_UNREACHABLE:
+                    log.error(f"Coordinator unreachable, giving up: {e}")
+                    exit(1)
+                log.warning(f"Coordinator unreachable ({e}), retrying")
+                time.sleep(5)
+                continue
+            if code == 410:
+                log.info("Coordinator reports the migration finished")
+                return
+            if code == 204:
+                time.sleep(POLL_INTERVAL)
+                continue
+            if code != 200:
+                log.error(f"Unexpected coordinator response {code}: {entry}")
+                exit(1)
+            log.info(f"[{entry['name']}] Migrating {entry['from']} to {entry['to']}")
+            self.process(entry)
@@ -2,6 +2,7 @@ import argparse
 from utils.logger import log, stream_handler, file_handler
 from utils.config import Config
 from migrate import Migrate
+from cluster import Coordinator, Worker
 import sys
 import signal
 def main():
@@ -15,6 +16,12 @@ def main():
     parser.add_argument("--dry-run", "-n", help="Perform a dry run", action="store_true")
     parser.add_argument("--unmount", "-u", help="Unmount all the directory", action="store_true")
     parser.add_argument("--mapping", "-p", help="Path to mapping file", action="store_true")
+    parser.add_argument("--tune-mount", "-t", help="Benchmark the NFS mount profiles and save the fastest", action="store_true")
+    parser.add_argument("--delta", help="Only transfer the paths changed since the last run (local sources with changeCapture)", action="store_true")
+    parser.add_argument("--watch", "-w", help="Record the changed paths of the source with inotify until interrupted", action="store_true")
+    parser.add_argument("--profile", help="Profile each transfer from /proc and write timelines and bottleneck summaries to DIR", nargs="?", const="profiles", action="store")
+    parser.add_argument("--coordinator", help="Serve the mapping queue to workers on [HOST:]PORT", nargs="?", const="0.0.0.0:80", action="store")
+    parser.add_argument("--worker", help="Migrate the entries leased by the coordinator at URL", action="store")
     args = parser.parse_args()
 
     if args.verbose:
@@ -28,18 +35,26 @@ def main():
     if args.display:
         config = Config(args.config)
         config.display()
-    if args.mount or args.run or args.unmount:
-        migration = Migrate(Config(args.config), args.dry_run)
+    if args.mount or args.run or args.unmount or args.tune_mount or args.coordinator or args.worker or args.watch:
+        migration = Migrate(Config(args.config), args.dry_run, args.delta, args.profile)
     if args.unmount:
         migration.unmount()
+    if args.tune_mount:
+        migration.tune_mount()
     if args.mount:
         migration.mount()
     if args.mapping:
         config = Config(args.config)
         config.mapping()
+    if args.watch:
+        migration.watch()
     if args.run:
         migration.run()
-    if not args.generate and not args.display and not args.mount and not args.run and not args.unmount and not args.mapping:
+    if args.coordinator:
+        Coordinator(migration, args.coordinator).run()
+    if args.worker:
+        Worker(migration, args.worker).run()
+    if not args.generate and not args.display and not args.mount and not args.run and not args.unmount and not args.mapping and not args.tune_mount and not args.coordinator and not args.worker and not args.watch:
         parser.print_help()
 
 def signal_handler(sig, frame):
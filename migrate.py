@@ -1,8 +1,19 @@
-from utils.config import Config
+from utils.config import Config, NFS_PROFILES, SSHFS_PROFILES
 from utils.logger import log
+from utils import benchmark
+from utils.changes import Inventory, Watcher, read_journal, write_list
+from utils.profiler import Profiler
+from utils.scheduler import Scheduler
+from utils.controller import AdaptiveController, INTERVAL as CONTROLLER_INTERVAL
+from utils.files import BatchProgress, batches, state_file, STATE_PATH, BATCH_FILES, BATCH_BYTES
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import nullcontext
+from functools import lru_cache
 import os
 import subprocess
 import re
+import threading
+import time
 from rich.progress import Progress
 
 
@@ -10,15 +21,88 @@ def is_mounted(mount_path):
     """Check if the given mount path is currently mounted."""
     mount_path = os.path.realpath(mount_path)
     with open('/proc/mounts', 'r') as f:
-        mounts = f.read()
-    log.debug(f"Checking if {mount_path} is mounted ({mount_path in mounts})")
-    return mount_path in mounts
+        # Compare whole mount points, /source/node1 must not match /source/node10
+        mounted = any(line.split()[1].replace("\\040", " ") == mount_path for line in f)
+    log.debug(f"Checking if {mount_path} is mounted ({mounted})")
+    return mounted
+
+
+def mount_options(options):
+    """Render a mount options dictionary as a `-o` string."""
+    rendered = []
+    for key, value in (options or {}).items():
+        if value is None or value is False:
+            continue
+        rendered.append(key if value is True else f"{key}={value}")
+    return ",".join(rendered)
+
+
+def build_nfs_mount_cmd(config):
+    """Build the NFS mount command for the given source configuration."""
+    nfs_mount_cmd = ["mount", "-t", "nfs"]  # Specify NFS as the file system type
+    options = mount_options(config.get("options"))
+    if options:
+        nfs_mount_cmd += ["-o", options]
+    return nfs_mount_cmd + [
+        # Server and path in format server:/path
+        f"{config['server']}:{config['serverPath']}",
+        config["mountPath"]  # Local mount point
+    ]
+
+
+@lru_cache(maxsize=None)
+def sshfs_version():
+    """Return the installed SSHFS version as a tuple, (0,) when it cannot be determined."""
+    try:
+        output = subprocess.run(["sshfs", "--version"], stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, universal_newlines=True).stdout
+    except OSError:
+        return (0,)
+    match = re.search(r"SSHFS version (\d+(?:\.\d+)*)", output)
+    return tuple(int(v) for v in match.group(1).split(".")) if match else (0,)
+
+
+def sshfs_profile(name):
+    """Return the options of an SSHFS profile supported by the installed sshfs."""
+    options = dict(SSHFS_PROFILES.get(name, {}))
+    # sshfs 2.x is multithreaded already but rejects max_conns (added in 3.7)
+    if "max_conns" in options and sshfs_version() < (3, 7):
+        log.debug(
+            f"Dropping max_conns from SSHFS profile {name}, sshfs {'.'.join(map(str, sshfs_version()))} does not support it")
+        del options["max_conns"]
+    return options
+
+
+def sshfs_mount_path(config, host):
+    """Return the local mount point of an SSHFS host ($path + /$node)."""
+    return os.path.join(config["mountPath"], host["hostname"])
+
+
+def mapping_entries(mapping):
+    """Return the mapping as (name, {"from", "to"}) pairs, whether entries are named (pvc) or not (custom)."""
+    entries = []
+    for entry in mapping:
+        if "from" in entry and "to" in entry:
+            entries.append((entry["from"], entry))
+        else:
+            entries.extend(entry.items())
+    # Leases, batch progress and inventories are keyed by name, a duplicate would be skipped or share their state
+    names = [name for name, _ in entries]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        log.error(
+            f"Duplicate mapping entries {', '.join(duplicates)}, name each entry (name: {{from, to}}) to copy one source to several destinations")
+        exit(1)
+    return entries
 
 
 class Migrate:
-    def __init__(self, config: Config, dry_run: bool = False):
+    def __init__(self, config: Config, dry_run: bool = False, delta: bool = False, profile: str = None):
         self._config = config
         self.dry_run = dry_run
+        self.delta = delta
+        self.profile = profile
+        self.device_names = {}
 
         self._config.validate()
         self.config = self._config.plain()
@@ -36,13 +120,7 @@ class Migrate:
         mount_path = config["mountPath"]
 
         # NFS mount command construction
-        nfs_mount_cmd = [
-            "mount",
-            "-t", "nfs",  # Specify NFS as the file system type
-            # Server and path in format server:/path
-            f"{server}:{server_path}",
-            mount_path  # Local mount point
-        ]
+        nfs_mount_cmd = build_nfs_mount_cmd(config)
 
         # Log the command for debugging
         log.info(f"Executing NFS mount command: {' '.join(nfs_mount_cmd)}")
@@ -76,11 +154,17 @@ class Migrate:
 
     def mount_sshfs(self, config):
         log.debug("Mounting source directory via SSHFS")
-        for host in config["hosts"]:
+        # Free-form options, followed by the options of the selected performance profile
+        sshfs_options = ",".join(filter(None, [
+            config.get('options', ''),
+            mount_options(sshfs_profile(config.get('profile', 'default'))),
+        ]))
+
+        def mount_host(host):
             remote_path = f"{host['user']}@{host['ip']}:{host['mountPath']}"
-            mount_path = config['mountPath']
-            # Get options, default to empty string if not present
-            sshfs_options = config.get('options', '')
+            # Each host is mounted in its own directory ($path + /$node)
+            mount_path = sshfs_mount_path(config, host)
+            os.makedirs(mount_path, exist_ok=True)
             # Use default SSH port 22 if not specified
             port = host.get('port', '22')
 
@@ -88,7 +172,10 @@ class Migrate:
             sshfs_cmd = [
                 "sshfs",
                 f"-oPort={port}",  # Add port option
-                f"-o{sshfs_options}",     # Additional SSHFS options
+            ]
+            if sshfs_options:
+                sshfs_cmd.append(f"-o{sshfs_options}")  # Additional SSHFS options
+            sshfs_cmd += [
                 remote_path,       # Remote directory (user@ip:/path)
                 mount_path         # Local mount point
             ]
@@ -100,14 +187,20 @@ class Migrate:
             try:
                 subprocess.run(sshfs_cmd, check=True)
                 log.info(f"Successfully mounted {remote_path} to {mount_path}")
+                return True
             except subprocess.CalledProcessError as e:
                 log.error(
                     f"Failed to mount {remote_path} to {mount_path}: {e}")
-                exit(1)
             except Exception as e:
                 log.error(
                     f"An unexpected error occurred while mounting {remote_path}: {e}")
-                exit(1)
+            return False
+
+        # Mount every host at once, the SSH handshakes are independent
+        with ThreadPoolExecutor(max(1, len(config["hosts"]))) as executor:
+            results = list(executor.map(mount_host, config["hosts"]))
+        if not all(results):
+            exit(1)
 
     mount_index = {
         "nfs": lambda self, config: self.mount_nfs(config),
@@ -164,34 +257,41 @@ class Migrate:
 
     def unmount_sshfs(self, config):
         log.debug("Unmounting source directory via SSHFS")
-        mount_path = config["mountPath"]
 
-        # Check if the directory is mounted
-        if not is_mounted(mount_path):
-            log.info(f"{mount_path} is not mounted. Skipping unmount.")
-            return
+        def unmount_host(host):
+            mount_path = sshfs_mount_path(config, host)
 
-        # SSHFS unmount command construction
-        sshfs_unmount_cmd = [
-            "fusermount",
-            "-u",  # Unmount
-            mount_path  # Local mount point
-        ]
+            # Check if the directory is mounted
+            if not is_mounted(mount_path):
+                log.info(f"{mount_path} is not mounted. Skipping unmount.")
+                return True
 
-        # Log the command for debugging
-        log.info(
-            f"Executing SSHFS unmount command: {' '.join(sshfs_unmount_cmd)}")
+            # SSHFS unmount command construction
+            sshfs_unmount_cmd = [
+                "fusermount",
+                "-u",  # Unmount
+                mount_path  # Local mount point
+            ]
 
-        # Execute the SSHFS unmount command
-        try:
-            subprocess.run(sshfs_unmount_cmd, check=True)
-            log.info(f"Successfully unmounted {mount_path}")
-        except subprocess.CalledProcessError as e:
-            log.error(f"Failed to unmount {mount_path}: {e}")
-            exit(1)
-        except Exception as e:
-            log.error(
-                f"An unexpected error occurred while unmounting {mount_path}: {e}")
+            # Log the command for debugging
+            log.info(
+                f"Executing SSHFS unmount command: {' '.join(sshfs_unmount_cmd)}")
+
+            # Execute the SSHFS unmount command
+            try:
+                subprocess.run(sshfs_unmount_cmd, check=True)
+                log.info(f"Successfully unmounted {mount_path}")
+                return True
+            except subprocess.CalledProcessError as e:
+                log.error(f"Failed to unmount {mount_path}: {e}")
+            except Exception as e:
+                log.error(
+                    f"An unexpected error occurred while unmounting {mount_path}: {e}")
+            return False
+
+        with ThreadPoolExecutor(max(1, len(config["hosts"]))) as executor:
+            results = list(executor.map(unmount_host, config["hosts"]))
+        if not all(results):
             exit(1)
 
     unmount_index = {
@@ -228,7 +328,95 @@ class Migrate:
             self, self.config["destination"])
         pass
 
-    def migrate_rsync(self, source, destination, name):
+    """
+    Benchmark the NFS mount profiles and store the fastest one in the configuration
+    """
+
+    def tune_mount(self):
+        log.debug("Tuning source mount options")
+        source = self.config["source"]
+        if source["type"] != "nfs":
+            log.error(
+                f"Mount tuning is not supported for {source['type']} sources")
+            exit(1)
+
+        # Always benchmark the current options alongside the built-in profiles
+        candidates = {"current": dict(source.get("options") or {})}
+        for name, options in NFS_PROFILES.items():
+            if options not in candidates.values():
+                candidates[name] = dict(options)
+
+        if self.dry_run:
+            for name, options in candidates.items():
+                log.warning(
+                    f"Would benchmark NFS profile {name} ({' '.join(build_nfs_mount_cmd({**source, 'options': options}))})")
+            return
+
+        was_mounted = is_mounted(source["mountPath"])
+        warmed = False
+        results = {}
+        for name, options in candidates.items():
+            self.unmount_nfs(source)
+            nfs_mount_cmd = build_nfs_mount_cmd({**source, "options": options})
+            log.info(
+                f"Benchmarking NFS profile {name}: {' '.join(nfs_mount_cmd)}")
+            if subprocess.run(nfs_mount_cmd).returncode != 0:
+                log.warning(f"Skipping NFS profile {name}: mount failed")
+                continue
+            try:
+                # Warm the server cache once so the first profile is not penalized,
+                # then remount so the client attribute and dentry caches start empty again
+                if not warmed:
+                    benchmark.metadata_walk(source["mountPath"])
+                    benchmark.sequential_read(source["mountPath"])
+                    warmed = True
+                    self.unmount_nfs(source)
+                    if subprocess.run(nfs_mount_cmd).returncode != 0:
+                        log.warning(f"Skipping NFS profile {name}: mount failed")
+                        continue
+                # The metadata walk runs first, the sequential read walks the tree too and would fill the caches
+                metadata = benchmark.metadata_walk(source["mountPath"])
+                results[name] = (
+                    benchmark.sequential_read(source["mountPath"]),
+                    metadata,
+                )
+            finally:
+                self.unmount_nfs(source)
+
+        if not results:
+            log.error("No NFS profile could be mounted")
+            if was_mounted:
+                self.mount_nfs(source)
+            exit(1)
+
+        # Score each profile relative to the best sequential and metadata rates
+        best_sequential = max(r[0] for r in results.values()) or 1
+        best_metadata = max(r[1] for r in results.values()) or 1
+        scores = {
+            name: sequential / best_sequential + metadata / best_metadata
+            for name, (sequential, metadata) in results.items()
+        }
+        for name, (sequential, metadata) in results.items():
+            log.info(
+                f"NFS profile {name}: {sequential / 1024 / 1024:.1f} MiB/s sequential, {metadata:.0f} entries/s metadata (score {scores[name]:.2f})")
+        best = max(scores, key=scores.get)
+        log.info(f"Selected NFS profile {best}: {mount_options(candidates[best]) or 'no options'}")
+
+        source["options"] = candidates[best]
+        self._config.update_config()
+        if was_mounted:
+            self.mount_nfs(source)
+
+    """
+    Return a profiler for the transfers of a mapping entry, when profiling is enabled
+    """
+
+    def new_profiler(self, name):
+        if not self.profile or self.dry_run:
+            return None
+        return Profiler(name, self.profile, [self.config["source"]["mountPath"], self.config["destination"]["mountPath"]])
+
+    def migrate_rsync(self, source, destination, name, callback=None, files_from=None, progress=None, profiler=None, cancel=None):
         log.debug(f"Copying {source} to {destination}")
 
         # Prepare the rsync command
@@ -236,9 +424,12 @@ class Migrate:
             "rsync",
             self.config['tools']['options'],
             "--progress",
-            source,
-            destination
         ]
+        if files_from:
+            # Only transfer the listed paths, deleting those missing from the source
+            rsync_cmd += [f"--files-from={files_from}",
+                          "--from0", "--delete-missing-args"]
+        rsync_cmd += [source, destination]
 
         log.debug(f"Executing rsync command: {' '.join(rsync_cmd)}")
 
@@ -247,15 +438,27 @@ class Migrate:
             return
 
         try:
-            with Progress() as progress:
+            # Share the caller's progress display when transfers run concurrently
+            shared = progress is not None
+            # A profiler passed by the caller covers several transfers and is stopped by it
+            owned = profiler is None
+            profiler = profiler or self.new_profiler(name)
+            with nullcontext(progress) if shared else Progress() as progress:
                 task = progress.add_task(
                     f"[cyan]Migration {name} in progress...", total=100)
 
                 # Run the rsync process and capture output
                 process = subprocess.Popen(
                     rsync_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+                if profiler:
+                    profiler.add(process.pid)
+                if cancel is not None:
+                    threading.Thread(target=self.terminate_on, args=(
+                        process, cancel), daemon=True).start()
 
                 current_file = None  # To track the current file being transferred
+                # Files done and total from rsync's ir-chk/to-chk counter, the total grows while rsync scans (ir-chk)
+                checked, total, completed = 0, 0, 0
 
                 for line in process.stdout:
                     # log.debug(line.strip())  # Log each line from rsync
@@ -270,15 +473,36 @@ class Migrate:
                     match = re.search(r'(\d+)%', line)
                     if match:
                         percent_complete = int(match.group(1))
+                        counter = re.search(r'(?:to|ir)-ch(?:ec)?k=(\d+)/(\d+)', line)
+                        if counter:
+                            # The last line of a file, which is now counted in checked
+                            total = int(counter.group(2))
+                            checked = total - int(counter.group(1))
+                            percent_complete = 0
+                        if total:
+                            # Report the progress of the whole entry, not of the current file.
+                            # It may step back while ir-chk still discovers files, it is an estimate until to-chk
+                            completed = max(0, min(100, (checked * 100 + percent_complete) // total))
 
                         # Update the progress bar with the current file and progress
                         progress.update(
-                            task, description=f"[cyan]Migration {name} - {current_file}", completed=percent_complete)
+                            task, description=f"[cyan]Migration {name} - {current_file}", completed=completed)
+                        if callback:
+                            callback(completed)
 
                 process.wait()  # Wait for the process to complete
+                if profiler and owned:
+                    profiler.stop()
 
+                if cancel is not None and cancel.is_set():
+                    log.warning(f"[{name}] Transfer cancelled")
+                    exit(1)
                 if process.returncode == 0:
                     progress.update(task, completed=100)
+                    if shared:
+                        progress.remove_task(task)
+                    if callback:
+                        callback(100)
                     log.debug(
                         f"[{name}] Successfully copied {source} to {destination}")
                 else:
@@ -302,6 +526,202 @@ class Migrate:
                 f"An unexpected error occurred while copying {source} to {destination}: {e}")
             exit(1)
 
+    """
+    Stop an rsync process once the cancel event is set
+    """
+
+    def terminate_on(self, process, cancel):
+        while process.poll() is None:
+            if cancel.wait(1):
+                process.terminate()
+                return
+
+    """
+    Stream the source to rsync in bounded batches instead of a single file list
+    """
+
+    def migrate_batched(self, source, destination, name, batch, callback=None, progress=None, cancel=None):
+        state_path = batch.get("path", STATE_PATH)
+        max_files = int(batch.get("files", BATCH_FILES))
+        max_bytes = int(batch.get("bytes", BATCH_BYTES))
+        parallel = int(batch.get("parallel", 1))
+        done = BatchProgress(state_path, name)
+        profiler = self.new_profiler(name)
+        log.info(
+            f"[{name}] Streaming {source} in batches of {max_files} files or {max_bytes} bytes ({parallel} in parallel)")
+
+        def transfer(index, paths, size, progress):
+            files_from = state_file(state_path, name, f".batch-{index}")
+            write_list(files_from, paths)
+            self.migrate_rsync(source, destination, f"{name} #{index}",
+                               files_from=files_from, progress=progress, profiler=profiler, cancel=cancel)
+            os.remove(files_from)
+            if not self.dry_run:
+                done.record(index, paths)
+            return len(paths), size
+
+        with nullcontext(progress) if progress else Progress() as progress, ThreadPoolExecutor(parallel) as executor:
+            overall = progress.add_task(f"[cyan]Migration {name}", total=None)
+            files, transferred, skipped = 0, 0, 0
+            running = set()
+
+            def collect(futures):
+                nonlocal files, transferred
+                for future in futures:
+                    count, size = future.result()
+                    files += count
+                    transferred += size
+                    progress.update(overall, advance=count,
+                                    description=f"[cyan]Migration {name} - {files} files, {transferred / 1024 / 1024:.0f} MiB")
+
+            for index, paths, size in batches(source, max_files, max_bytes):
+                if cancel is not None and cancel.is_set():
+                    break
+                if done.done(index, paths):
+                    skipped += 1
+                    continue
+                # Keep a bounded number of batches in flight so the walk does not run ahead
+                while len(running) >= parallel * 2:
+                    finished, running = wait(running, return_when=FIRST_COMPLETED)
+                    collect(finished)
+                running.add(executor.submit(
+                    transfer, index, paths, size, progress))
+            collect(wait(running).done)
+        if profiler:
+            profiler.stop()
+        if cancel is not None and cancel.is_set():
+            # Keep the completed batches so the next attempt resumes after them
+            log.warning(f"[{name}] Transfer cancelled")
+            exit(1)
+
+        if skipped:
+            log.info(f"[{name}] Skipped {skipped} batches completed by a previous run")
+        log.debug(f"[{name}] Successfully copied {source} to {destination} in batches")
+        if callback:
+            callback(100)
+        if not self.dry_run:
+            # The next pass starts from the first batch again
+            done.reset()
+
+    """
+    Return the change capture configuration, only supported for local sources
+    """
+
+    def change_capture(self):
+        if self.config["source"]["type"] != "local":
+            return None
+        return self.config["source"].get("changeCapture")
+
+    """
+    Transfer only the paths changed since the last full pass
+    """
+
+    def migrate_delta(self, source, destination, name, capture, callback=None, progress=None, cancel=None):
+        state_path = capture.get("path", STATE_PATH)
+        inventory = Inventory(state_path, name, source)
+        if inventory.started() is None:
+            log.warning(
+                f"[{name}] No inventory recorded, running a full pass instead of a delta")
+            if not self.dry_run:
+                inventory.snapshot()
+            self.migrate_rsync(source, destination, name,
+                               callback, progress=progress, cancel=cancel)
+            return
+
+        started = time.time()
+        changed = None
+        if capture.get("type") == "inotify":
+            changed = read_journal(
+                state_path, self.config["source"]["mountPath"], source, inventory.started())
+        if changed is None:
+            log.info(f"[{name}] Comparing {source} with its inventory")
+            changed = inventory.changes()
+
+        files_from = inventory.path + ".delta"
+        count = write_list(files_from, changed)
+        log.info(f"[{name}] {count} paths changed since the last pass")
+        if count == 0:
+            if callback:
+                callback(100)
+        else:
+            self.migrate_rsync(source, destination, name,
+                               callback, files_from=files_from, progress=progress, cancel=cancel)
+        if not self.dry_run:
+            inventory.commit(started)
+
+    """
+    Record the paths changed in the source until interrupted
+    """
+
+    def watch(self):
+        capture = self.change_capture()
+        if not capture or capture.get("type") != "inotify":
+            log.error(
+                "Watching requires a local source with changeCapture.type set to inotify")
+            exit(1)
+        Watcher(self.config["source"]["mountPath"],
+                capture.get("path", STATE_PATH)).run()
+
+    """
+    Migrate a single mapping entry with the configured tool
+    """
+
+    def migrate_entry(self, name, migrate, callback=None, progress=None, cancel=None):
+        source = migrate['from'] + ("/" if not migrate['from'].endswith("/") else "")
+        destination = migrate['to'] + ("/" if not migrate['to'].endswith("/") else "")
+        tools = self.config['tools']
+        capture = self.change_capture()
+        if tools['type'] == 'rsync':
+            if capture and self.delta:
+                self.migrate_delta(source, destination, name,
+                                   capture, callback, progress, cancel)
+                return
+            if capture and not self.dry_run:
+                # Taken before the transfer so changes made while it runs show up in the delta
+                Inventory(capture.get("path", STATE_PATH),
+                          name, source).snapshot()
+            if tools.get('batch'):
+                self.migrate_batched(source, destination,
+                                     name, tools['batch'], callback, progress, cancel)
+            else:
+                self.migrate_rsync(source, destination, name,
+                                   callback, progress=progress, cancel=cancel)
+        else:
+            log.error(f"Unsupported tool {tools['type']}")
+            exit(1)
+
+    """
+    Return the storage devices a mapping entry reads from and writes to
+    """
+
+    def devices(self, migrate):
+        devices = set()
+        for side, path in (("source", migrate['from']), ("destination", migrate['to'])):
+            config = self.config[side]
+            if config["type"] == "nfs":
+                # Every export of a server shares its disks and network link
+                devices.add(f"nfs:{config['server']}")
+                continue
+            if config["type"] == "sshfs":
+                # Every volume of a node shares its disks and SSH link
+                host = next((h for h in config["hosts"] if os.path.realpath(path).startswith(
+                    os.path.realpath(sshfs_mount_path(config, h)) + "/")), None)
+                if host:
+                    devices.add(f"sshfs:{host['hostname']}")
+                    continue
+            # The entry may not exist yet, use its closest existing parent
+            path = os.path.abspath(path)
+            while not os.path.exists(path) and path != os.path.dirname(path):
+                path = os.path.dirname(path)
+            # Name the device after the first mount point seen for it so it can be set in concurrency.devices
+            device = os.stat(path).st_dev
+            if device not in self.device_names:
+                while not os.path.ismount(path):
+                    path = os.path.dirname(path)
+                self.device_names[device] = f"mount:{path}"
+            devices.add(self.device_names[device])
+        return devices
+
     """
     Perform a migration
     """
@@ -315,14 +735,53 @@ class Migrate:
                 "No mapping found in configuration please use --mapping option to provide mapping")
             exit(1)
 
-        for migrate in self.config['mapping']:
-            # This crash sometime
-            source = migrate['from'] + ("/" if not migrate['from'].endswith("/") else "")
-            destination = migrate['to'] + ("/" if not migrate['to'].endswith("/") else "")
-            tools = self.config['tools']
-            if tools['type'] == 'rsync':
-                self.migrate_rsync(source, destination, migrate['from'])
-            else:
-                log.error(f"Unsupported tool {tools['type']}")
-                exit(1)
-        pass
+        concurrency = self.config['tools'].get('concurrency', {})
+        workers = concurrency.get('workers', 1)
+        adaptive = workers == 'auto'
+        if not adaptive and int(workers) <= 1:
+            for name, migrate in mapping_entries(self.config['mapping']):
+                self.migrate_entry(name, migrate)
+            return
+
+        per_device = concurrency.get('perDevice')
+        scheduler = Scheduler(1 if adaptive else int(workers),
+                              per_device, concurrency.get('devices'))
+        tasks = []
+        groups = {}
+        for name, migrate in mapping_entries(self.config['mapping']):
+            devices = self.devices(migrate)
+            for device in devices:
+                groups.setdefault(device, []).append(name)
+            tasks.append((name, devices, migrate))
+        for device, names in groups.items():
+            log.info(
+                f"Device {device} (limit {scheduler.device_limit(device) or 'none'}): {', '.join(names)}")
+        wanted = min(len(tasks), int(concurrency.get(
+            'max', len(tasks))) if adaptive else int(workers))
+        reachable, full = scheduler.reachable(tasks)
+        if reachable < wanted:
+            log.warning(
+                f"Per-device limits allow only {reachable} of {wanted} concurrent transfers ({', '.join(full)} at their cap), raise tools.concurrency.perDevice or tools.concurrency.devices")
+
+        controller = None
+        if adaptive:
+            controller = AdaptiveController(
+                scheduler,
+                [self.config["source"]["mountPath"],
+                    self.config["destination"]["mountPath"]],
+                start=int(concurrency.get('start', 1)),
+                maximum=int(concurrency.get('max', len(tasks))),
+                interval=float(concurrency.get('interval', CONTROLLER_INTERVAL)),
+            )
+            controller.start()
+
+        try:
+            with Progress() as progress:
+                scheduler.run([
+                    (name, devices, lambda name=name, migrate=migrate: self.migrate_entry(
+                        name, migrate, progress=progress))
+                    for name, devices, migrate in tasks
+                ])
+        finally:
+            if controller:
+                controller.stop()
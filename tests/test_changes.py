@@ -0,0 +1,106 @@
+from utils.changes import Inventory, JOURNAL, OVERFLOW, read_journal, write_list
+import json
+import os
+import pytest
+
+
+def touch(path, data="x"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(data)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    source = tmp_path / "source"
+    for path in ["a b", "a-b", "a/b", "a/c/d", "a.b", "z"]:
+        touch(str(source / path))
+    return str(source), str(tmp_path / "state")
+
+
+def test_no_changes_after_a_snapshot(tree):
+    source, state = tree
+    inventory = Inventory(state, "v", source)
+    inventory.snapshot()
+    assert list(inventory.changes()) == []
+
+
+def test_created_modified_and_deleted_paths(tree):
+    source, state = tree
+    inventory = Inventory(state, "v", source)
+    inventory.snapshot()
+    touch(os.path.join(source, "a/c/new"))
+    touch(os.path.join(source, "a-b"), "longer")
+    os.remove(os.path.join(source, "a/b"))
+    os.remove(os.path.join(source, "z"))
+    # Directories whose entries changed are listed too, their mtime moved.
+    # The merge must line up paths whose order differs between plain string and per-component sorting
+    assert list(inventory.changes()) == ["a", "a/b", "a/c", "a/c/new", "a-b", "z"]
+
+
+def test_removed_directory_lists_its_entries(tree):
+    source, state = tree
+    inventory = Inventory(state, "v", source)
+    inventory.snapshot()
+    os.remove(os.path.join(source, "a/c/d"))
+    os.rmdir(os.path.join(source, "a/c"))
+    assert list(inventory.changes()) == ["a", "a/c", "a/c/d"]
+
+
+def test_metadata_change_without_mtime_change(tree):
+    source, state = tree
+    inventory = Inventory(state, "v", source)
+    inventory.snapshot()
+    path = os.path.join(source, "a.b")
+    info = os.stat(path)
+    os.chmod(path, 0o600)
+    if os.geteuid() == 0:
+        os.chown(path, 1000, 1000)
+    os.utime(path, ns=(info.st_atime_ns, info.st_mtime_ns))
+    assert list(inventory.changes()) == ["a.b"]
+
+
+def test_commit_replaces_the_snapshot(tree):
+    source, state = tree
+    inventory = Inventory(state, "v", source)
+    inventory.snapshot()
+    touch(os.path.join(source, "new"))
+    assert list(inventory.changes()) == ["new"]
+    inventory.commit(1000)
+    assert inventory.started() == 1000
+    assert list(inventory.changes()) == []
+
+
+def test_write_list_is_nul_separated(tmp_path):
+    path = str(tmp_path / "list")
+    assert write_list(path, ["a", "b c", "d/e"]) == 3
+    with open(path, "rb") as f:
+        assert f.read() == b"a\0b c\0d/e\0"
+
+
+def journal(state, started, paths):
+    os.makedirs(state, exist_ok=True)
+    with open(os.path.join(state, JOURNAL), "w") as f:
+        f.write(json.dumps({"started": started}) + "\n")
+        for path in paths:
+            f.write(json.dumps(path) + "\n")
+
+
+def test_read_journal_keeps_the_paths_below_source(tmp_path):
+    root, state = str(tmp_path / "root"), str(tmp_path / "state")
+    os.makedirs(os.path.join(root, "v"))
+    journal(state, 10, ["v/b", "w/a", "v/a/x", "v/b", "v"])
+    assert read_journal(state, root, os.path.join(root, "v"), 20) == ["a/x", "b"]
+    assert read_journal(state, root, root, 20) == ["v", "v/a/x", "v/b", "w/a"]
+
+
+def test_read_journal_falls_back_to_the_inventory(tmp_path):
+    root, state = str(tmp_path / "root"), str(tmp_path / "state")
+    os.makedirs(root)
+    assert read_journal(state, root, root, 20) is None
+    # Started after the last full pass, changes before it are missing
+    journal(state, 30, ["a"])
+    assert read_journal(state, root, root, 20) is None
+    journal(state, 10, ["a"])
+    open(os.path.join(state, OVERFLOW), "w").close()
+    assert read_journal(state, root, root, 20) is None
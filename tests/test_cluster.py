@@ -0,0 +1,171 @@
+from cluster import Coordinator, Worker, MAX_ATTEMPTS
+from migrate import mapping_entries
+from http.server import ThreadingHTTPServer
+import socket
+import threading
+import time
+import pytest
+
+
+class FakeMigration:
+    """Stands in for Migrate, transfer(name, cancel) plays the role of rsync."""
+
+    def __init__(self, mapping, lease_timeout=60, transfer=None):
+        self.config = {"mapping": mapping, "cluster": {"leaseTimeout": lease_timeout}}
+        self.transfer = transfer or (lambda name, cancel: None)
+        self.migrated = []
+
+    def migrate_entry(self, name, migrate, callback=None, progress=None, cancel=None):
+        self.transfer(name, cancel)
+        self.migrated.append(name)
+        callback(100)
+
+
+def mapping(*names):
+    return [{name: {"from": f"/source/{name}", "to": f"/destination/{name}"}} for name in names]
+
+
+def serve(coordinator):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), coordinator.handler())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def reachable(url):
+    try:
+        return Worker(None, url).request("/status")[0] == 200
+    except OSError:
+        return False
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+def test_lease_hands_out_each_entry_once():
+    coordinator = Coordinator(FakeMigration(mapping("a", "b")))
+    first, second = coordinator.lease("w1"), coordinator.lease("w2")
+    assert {first["name"], second["name"]} == {"a", "b"}
+    assert first["to"] == "/destination/a"
+    assert coordinator.lease("w3") is None
+    assert not coordinator.finished()
+
+    assert coordinator.complete(first["lease"], True)
+    assert coordinator.complete(second["lease"], True)
+    assert coordinator.finished()
+    assert coordinator.status()["done"] == ["a", "b"]
+
+
+def test_expired_lease_is_requeued_and_the_old_holder_rejected():
+    coordinator = Coordinator(FakeMigration(mapping("a")))
+    entry = coordinator.lease("w1")
+    assert coordinator.renew(entry["lease"], 40)
+    assert coordinator.status()["progress"]["a"] == 40
+
+    coordinator.leases[entry["lease"]]["expires"] = 0
+    coordinator.reap()
+    assert coordinator.status()["pending"] == ["a"]
+    assert not coordinator.renew(entry["lease"], 50)
+    assert not coordinator.complete(entry["lease"], True)
+
+    again = coordinator.lease("w2")
+    assert again["name"] == "a"
+    assert coordinator.attempts["a"] == 2
+    assert coordinator.status()["running"] == {"a": "w2"}
+
+
+def test_failed_entry_is_retried_then_given_up():
+    coordinator = Coordinator(FakeMigration(mapping("a")))
+    for _ in range(MAX_ATTEMPTS):
+        assert not coordinator.finished()
+        entry = coordinator.lease("w1")
+        coordinator.complete(entry["lease"], False, "exit code 1")
+    assert coordinator.lease("w1") is None
+    assert coordinator.status()["failed"] == ["a"]
+    assert coordinator.finished()
+
+
+def test_duplicate_entry_names_are_rejected():
+    with pytest.raises(SystemExit):
+        mapping_entries([{"from": "/source/a", "to": "/destination/1"},
+                         {"from": "/source/a", "to": "/destination/2"}])
+    named = mapping_entries([{"one": {"from": "/source/a", "to": "/destination/1"}},
+                             {"two": {"from": "/source/a", "to": "/destination/2"}}])
+    assert [name for name, _ in named] == ["one", "two"]
+
+
+def test_worker_cancels_the_transfer_when_its_lease_is_lost():
+    cancelled = threading.Event()
+
+    def transfer(name, cancel):
+        # Like migrate_rsync, a cancelled transfer fails
+        if cancel.wait(10):
+            cancelled.set()
+            exit(1)
+
+    migration = FakeMigration(mapping("a"), lease_timeout=0.6, transfer=transfer)
+    coordinator = Coordinator(migration)
+    server, url = serve(coordinator)
+    try:
+        worker = Worker(migration, url, "w1")
+        code, entry = worker.request("/lease", {"worker": "w1"})
+        assert code == 200
+        thread = threading.Thread(target=worker.process, args=(entry,))
+        thread.start()
+        # The coordinator gives the entry away, as it does when the worker stalls past its lease
+        coordinator.leases[entry["lease"]]["expires"] = 0
+        coordinator.reap()
+        thread.join(10)
+        assert not thread.is_alive()
+    finally:
+        server.shutdown()
+    assert cancelled.is_set()
+    assert migration.migrated == []
+    assert coordinator.status()["pending"] == ["a"]
+    assert not coordinator.done
+
+
+def test_workers_take_over_an_abandoned_entry_and_exit_once_finished():
+    migration = FakeMigration(mapping("a", "b", "c"), lease_timeout=1,
+                              transfer=lambda name, cancel: time.sleep(0.2))
+    address = f"127.0.0.1:{free_port()}"
+    coordinator = Coordinator(migration, address)
+    thread = threading.Thread(target=coordinator.run, daemon=True)
+    thread.start()
+    url = f"http://{address}"
+    wait_for(lambda: reachable(url))
+
+    # A worker that leases an entry and dies without renewing it
+    code, abandoned = Worker(migration, url).request("/lease", {"worker": "dead"})
+    assert code == 200
+
+    results = {}
+
+    def work(worker_id):
+        try:
+            Worker(migration, url, worker_id).run()
+            results[worker_id] = 0
+        except SystemExit as e:
+            results[worker_id] = e.code
+
+    workers = [threading.Thread(target=work, args=(f"w{i}",), daemon=True) for i in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+    thread.join(30)
+
+    assert not thread.is_alive()
+    assert results == {"w0": 0, "w1": 0}
+    assert sorted(migration.migrated) == ["a", "b", "c"]
+    assert coordinator.attempts[abandoned["name"]] == 2
+    assert coordinator.done == {"a", "b", "c"}
@@ -0,0 +1,142 @@
+from utils.controller import AdaptiveController, PROBE_AFTER
+import subprocess
+import sys
+
+MB = 1024 * 1024
+
+
+class FakeScheduler:
+    """Runs as many transfers as the limit allows, unless `busy` says otherwise."""
+
+    def __init__(self):
+        self.limit = 1
+        self.busy = None
+        self.queued = True
+
+    @property
+    def running(self):
+        return self.limit if self.busy is None else self.busy
+
+    def set_limit(self, limit):
+        self.limit = limit
+
+    def waiting(self):
+        return self.queued
+
+
+def controller(start=1, maximum=16):
+    scheduler = FakeScheduler()
+    return scheduler, AdaptiveController(scheduler, start=start, maximum=maximum)
+
+
+def step(controller, rate, rtt=None):
+    """One decision window of a second moving `rate` MiB with the given NFS round-trip time."""
+    controller.transferred = lambda: rate * MB
+    controller.rtt = lambda: rtt
+    controller.step(1.0)
+
+
+def test_probes_while_throughput_improves():
+    scheduler, adaptive = controller()
+    step(adaptive, 100)
+    assert scheduler.limit == 2
+    step(adaptive, 180)
+    assert scheduler.limit == 3
+    step(adaptive, 250)
+    assert scheduler.limit == 4
+    assert adaptive.best == (250 * MB, 3)
+
+
+def test_settles_back_when_throughput_flattens():
+    scheduler, adaptive = controller(start=4)
+    step(adaptive, 100)
+    assert scheduler.limit == 5
+    step(adaptive, 101)
+    # int(5 * SETTLE)
+    assert scheduler.limit == 3
+    # The window after a decrease only measures the new level
+    step(adaptive, 90)
+    assert scheduler.limit == 3
+    step(adaptive, 90)
+    assert scheduler.limit == 3
+
+
+def test_backs_off_when_throughput_drops():
+    scheduler, adaptive = controller(start=8)
+    step(adaptive, 100)
+    step(adaptive, 120)
+    assert scheduler.limit == 10
+    step(adaptive, 50)
+    assert scheduler.limit == 5
+
+
+def test_backs_off_on_nfs_latency_spike():
+    scheduler, adaptive = controller(start=6)
+    step(adaptive, 100, rtt=2.0)
+    assert scheduler.limit == 7
+    step(adaptive, 100, rtt=5.0)
+    assert scheduler.limit == 3
+    assert adaptive.baseline_rtt == 2.0
+
+
+def test_waits_for_running_transfers_to_reach_a_lower_limit():
+    scheduler, adaptive = controller(start=8)
+    step(adaptive, 100)
+    step(adaptive, 40)
+    assert scheduler.limit == 4
+    scheduler.busy = 9
+    step(adaptive, 10)
+    assert scheduler.limit == 4
+
+
+def test_probes_again_after_a_stable_period():
+    scheduler, adaptive = controller(start=2)
+    step(adaptive, 100)
+    step(adaptive, 101)
+    assert scheduler.limit == 2
+    step(adaptive, 100)
+    for _ in range(PROBE_AFTER - 1):
+        step(adaptive, 100)
+        assert scheduler.limit == 2
+    step(adaptive, 100)
+    assert scheduler.limit == 3
+
+
+def test_draining_queue_is_not_judged():
+    scheduler, adaptive = controller(start=4)
+    step(adaptive, 100)
+    assert scheduler.limit == 5
+    scheduler.queued = False
+    scheduler.busy = 2
+    step(adaptive, 10)
+    assert scheduler.limit == 5
+    assert adaptive.previous is None
+
+
+def test_device_capped_level_is_held_not_probed():
+    scheduler, adaptive = controller(start=4)
+    scheduler.busy = 2
+    step(adaptive, 100)
+    assert scheduler.limit == 4
+    step(adaptive, 200)
+    assert scheduler.limit == 4
+    assert adaptive.blocked
+    # A drop is judged against the level that runs, not the limit
+    step(adaptive, 50)
+    assert scheduler.limit == 1
+
+
+def test_limit_stays_within_bounds():
+    scheduler, adaptive = controller(start=2, maximum=2)
+    step(adaptive, 100)
+    assert scheduler.limit == 2
+    adaptive.set_limit(0, "test")
+    assert scheduler.limit == 1
+
+
+def test_transferred_counts_processes_that_already_exited():
+    _, adaptive = controller()
+    adaptive.transferred()
+    subprocess.run([sys.executable, "-c", "import os; os.write(os.open(os.devnull, os.O_WRONLY), b'x' * 4000000)"],
+                   check=True)
+    assert adaptive.transferred() >= 4000000
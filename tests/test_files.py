@@ -0,0 +1,66 @@
+from utils.files import BatchProgress, batches, path_key, walk
+import os
+import pytest
+
+
+@pytest.fixture
+def source(tmp_path):
+    root = tmp_path / "source"
+    files = {"a b": 1, "a-b": 2, "a/b": 3, "a/c/d": 4, "a.b": 5, "a0": 6, "b/a": 7, "z": 8}
+    for path, size in files.items():
+        os.makedirs(os.path.dirname(root / path), exist_ok=True)
+        with open(root / path, "wb") as f:
+            f.write(b"x" * size)
+    os.symlink("z", root / "link")
+    return str(root)
+
+
+def test_walk_yields_every_entry_in_path_key_order(source):
+    paths = [path for path, _ in walk(source)]
+    assert sorted(paths) == sorted(["a", "a b", "a-b", "a.b", "a/b", "a/c", "a/c/d",
+                                    "a0", "b", "b/a", "link", "z"])
+    assert paths == sorted(paths, key=path_key)
+    # Plain string order puts "a b" before "a/b", the walk does not
+    assert paths != sorted(paths)
+
+
+def test_walk_does_not_follow_symlinks(tmp_path):
+    os.makedirs(tmp_path / "target" / "inside")
+    os.makedirs(tmp_path / "source")
+    os.symlink(tmp_path / "target", tmp_path / "source" / "link")
+    assert [path for path, _ in walk(str(tmp_path / "source"))] == ["link"]
+
+
+def test_batches_respect_file_and_byte_bounds(source):
+    result = list(batches(source, max_files=3, max_bytes=1024))
+    assert [index for index, _, _ in result] == list(range(len(result)))
+    assert all(len(paths) <= 3 for _, paths, _ in result)
+    assert [p for _, paths, _ in result for p in paths] == [path for path, _ in walk(source)]
+
+    by_size = list(batches(source, max_files=100, max_bytes=10))
+    assert all(size <= 10 for _, _, size in by_size)
+    # A single file over the bound still gets a batch of its own
+    assert list(batches(source, max_files=100, max_bytes=1))[0][1] == ["a"]
+
+
+def test_batch_progress_resumes_unchanged_batches(source, tmp_path):
+    state = str(tmp_path / "state")
+    first = list(batches(source, max_files=3))
+    progress = BatchProgress(state, "v")
+    progress.record(0, first[0][1])
+    progress.record(1, first[1][1])
+
+    resumed = BatchProgress(state, "v")
+    assert resumed.done(0, first[0][1])
+    assert resumed.done(1, first[1][1])
+    assert not resumed.done(2, first[2][1])
+
+    # A new entry shifts the following batches, they no longer match their fingerprint
+    with open(os.path.join(source, "a c"), "w"):
+        pass
+    shifted = list(batches(source, max_files=3))
+    assert resumed.done(0, shifted[0][1])
+    assert not resumed.done(1, shifted[1][1])
+
+    resumed.reset()
+    assert not BatchProgress(state, "v").done(0, first[0][1])
@@ -0,0 +1,120 @@
+from utils.config import Config
+from utils.scheduler import Scheduler
+import threading
+import time
+import pytest
+import yaml
+
+
+class Tracker:
+    """Record the highest number of tasks running at once, overall and per device."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.peak = {}
+
+    def task(self, name, devices, duration=0.05):
+        def run():
+            with self.lock:
+                for key in ["all", *devices]:
+                    self.running[key] = self.running.get(key, 0) + 1
+                    self.peak[key] = max(self.peak.get(key, 0), self.running[key])
+            time.sleep(duration)
+            with self.lock:
+                for key in ["all", *devices]:
+                    self.running[key] -= 1
+        return (name, set(devices), run)
+
+
+def test_global_and_device_limits_are_respected():
+    tracker = Tracker()
+    tasks = [tracker.task(f"a{i}", ["nfs:a"]) for i in range(4)] + \
+        [tracker.task(f"b{i}", ["nfs:b"]) for i in range(4)]
+    Scheduler(limit=3, per_device=2).run(tasks)
+    assert tracker.peak == {"all": 3, "nfs:a": 2, "nfs:b": 2}
+
+
+def test_capped_device_does_not_hold_back_the_queue():
+    tracker = Tracker()
+    tasks = [tracker.task(f"a{i}", ["nfs:a"], 0.2) for i in range(3)] + [tracker.task("b", ["nfs:b"], 0.2)]
+    started = time.monotonic()
+    Scheduler(limit=4, device_limits={"nfs:a": 1}).run(tasks)
+    # b runs next to the first a instead of waiting behind the other two
+    assert tracker.peak["all"] == 2
+    assert time.monotonic() - started < 0.75
+
+
+def test_device_limits_override_per_device():
+    scheduler = Scheduler(limit=8, per_device=1, device_limits={"nfs:a": 3})
+    assert scheduler.device_limit("nfs:a") == 3
+    assert scheduler.device_limit("nfs:b") == 1
+    assert Scheduler(limit=8).device_limit("nfs:a") is None
+
+
+def test_reachable_counts_the_tasks_device_caps_let_run():
+    tasks = [("a1", {"nfs:a", "mount:/dst"}, None), ("a2", {"nfs:a", "mount:/dst"}, None),
+             ("b1", {"nfs:b", "mount:/dst"}, None), ("b2", {"nfs:b"}, None)]
+    assert Scheduler(limit=4, per_device=2).reachable(tasks) == (3, ["mount:/dst", "nfs:a"])
+    assert Scheduler(limit=4).reachable(tasks) == (4, [])
+
+
+def test_task_that_can_never_start_raises():
+    done = []
+    with pytest.raises(RuntimeError):
+        Scheduler(limit=2, per_device=0).run([("a", {"d"}, lambda: done.append("a"))])
+    assert done == []
+
+
+def test_failure_is_reraised_after_running_tasks_finish():
+    tracker = Tracker()
+
+    def fail():
+        exit(1)
+
+    tasks = [tracker.task("slow", ["d1"], 0.2), ("broken", {"d2"}, fail)] + \
+        [tracker.task(f"later{i}", ["d1"]) for i in range(3)]
+    with pytest.raises(SystemExit):
+        Scheduler(limit=2, per_device=1).run(tasks)
+    # The failure stops new tasks, the slow one still ran to the end
+    assert tracker.peak["d1"] == 1
+    assert tracker.running["d1"] == 0
+
+
+def test_set_limit_wakes_the_scheduler():
+    tracker = Tracker()
+    scheduler = Scheduler(limit=1)
+    threading.Timer(0.1, scheduler.set_limit, args=(4,)).start()
+    scheduler.run([tracker.task(f"t{i}", ["d"], 0.3) for i in range(4)])
+    assert tracker.peak["all"] >= 3
+
+
+def validate(tmp_path, concurrency):
+    path = tmp_path / "config.yaml"
+    path.write_text(yaml.safe_dump({
+        "source": {"type": "local", "mountPath": "/source"},
+        "destination": {"type": "local", "mountPath": "/destination"},
+        "tools": {"type": "rsync", "options": "-a", "concurrency": concurrency},
+    }))
+    Config(str(path)).validate()
+
+
+@pytest.mark.parametrize("concurrency", [
+    {"workers": 4, "perDevice": 0},
+    {"workers": 4, "perDevice": "2"},
+    {"workers": 4, "devices": {"nfs:a": 0}},
+    {"workers": 4, "devices": {"nfs:a": 1.5}},
+    {"workers": "four"},
+])
+def test_invalid_concurrency_is_rejected(tmp_path, concurrency):
+    with pytest.raises(SystemExit):
+        validate(tmp_path, concurrency)
+
+
+@pytest.mark.parametrize("concurrency", [
+    {"workers": 4, "perDevice": 1, "devices": {"nfs:a": 3}},
+    {"workers": "4"},
+    {"workers": "auto", "perDevice": None},
+])
+def test_valid_concurrency_is_accepted(tmp_path, concurrency):
+    validate(tmp_path, concurrency)
@@ -0,0 +1,59 @@
+from utils.logger import log
+import os
+import time
+
+# Default limits for a single benchmark run, kept small so tuning a mount takes seconds, not minutes
+SEQUENTIAL_BYTES = 256 * 1024 * 1024
+SEQUENTIAL_BLOCK = 1024 * 1024
+METADATA_ENTRIES = 20000
+
+
+def sequential_read(path, max_bytes=SEQUENTIAL_BYTES, block_size=SEQUENTIAL_BLOCK):
+    """Read files under path sequentially until max_bytes are read, return the throughput in bytes/s."""
+    total = 0
+    start = time.monotonic()
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            try:
+                with open(file_path, 'rb', buffering=0) as f:
+                    while total < max_bytes:
+                        chunk = f.read(block_size)
+                        if not chunk:
+                            break
+                        total += len(chunk)
+            except OSError as e:
+                log.debug(f"Skipping {file_path} during sequential benchmark: {e}")
+            if total >= max_bytes:
+                break
+        if total >= max_bytes:
+            break
+    elapsed = time.monotonic() - start
+    log.debug(f"Sequential read: {total} bytes in {elapsed:.2f}s")
+    return total / elapsed if elapsed > 0 else 0.0
+
+
+def metadata_walk(path, max_entries=METADATA_ENTRIES):
+    """Walk and stat up to max_entries entries under path, return the rate in entries/s."""
+    count = 0
+    start = time.monotonic()
+    stack = [path]
+    while stack and count < max_entries:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    try:
+                        entry.stat(follow_symlinks=False)
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                    except OSError:
+                        continue
+                    count += 1
+                    if count >= max_entries:
+                        break
+        except OSError as e:
+            log.debug(f"Skipping {current} during metadata benchmark: {e}")
+    elapsed = time.monotonic() - start
+    log.debug(f"Metadata walk: {count} entries in {elapsed:.2f}s")
+    return count / elapsed if elapsed > 0 else 0.0
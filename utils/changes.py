@@ -0,0 +1,254 @@
+from utils.logger import log
+from utils.files import walk, path_key, state_file
+import ctypes
+import errno
+import json
+import os
+import stat
+import struct
+import time
+
+JOURNAL = "journal"
+OVERFLOW = "journal.overflow"
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_ONLYDIR | IN_DONT_FOLLOW)
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def write_list(path, paths):
+    """Write paths as a NUL separated rsync --files-from list (--from0), return how many were written."""
+    count = 0
+    with open(path, "wb") as f:
+        for relative in paths:
+            f.write(os.fsencode(relative) + b"\0")
+            count += 1
+    return count
+
+
+class Inventory:
+    """
+    Snapshot of (path, size, mtime, mode, ctime) for every entry of a source directory, stored as sorted JSON lines.
+    The ctime catches what rsync -a copies without touching the mtime: owner, group, permissions and xattrs/ACLs.
+    Diffing a fresh walk against the snapshot is a streaming merge, so memory stays flat on huge trees.
+    """
+
+    def __init__(self, state_path, name, source):
+        self.source = source
+        self.path = state_file(state_path, name, ".inventory")
+        os.makedirs(state_path, exist_ok=True)
+
+    def records(self, path):
+        try:
+            with open(path, "r") as f:
+                for line in f:
+                    yield json.loads(line)
+        except FileNotFoundError:
+            return
+
+    def write(self, f):
+        for relative, info in walk(self.source):
+            record = [relative, info.st_size, info.st_mtime_ns, info.st_mode, info.st_ctime_ns]
+            f.write(json.dumps(record) + "\n")
+            yield record
+
+    """
+    Record the current state of the source, to be taken before the transfer it describes
+    """
+
+    def snapshot(self):
+        log.debug(f"Recording inventory of {self.source} in {self.path}")
+        started = time.time()
+        with open(self.path + ".new", "w") as f:
+            count = sum(1 for _ in self.write(f))
+        # The mtime of the inventory is the time its walk started
+        os.utime(self.path + ".new", (started, started))
+        os.replace(self.path + ".new", self.path)
+        log.debug(f"Inventory of {self.source} recorded ({count} entries)")
+
+    def started(self):
+        return os.path.getmtime(self.path) if os.path.exists(self.path) else None
+
+    """
+    Yield the paths created, modified or deleted since the snapshot, recording a new one aside
+    """
+
+    def changes(self):
+        old = self.records(self.path)
+        previous = next(old, None)
+        with open(self.path + ".new", "w") as f:
+            for record in self.write(f):
+                key = path_key(record[0])
+                # Everything sorting before the current path is gone from the source
+                while previous is not None and path_key(previous[0]) < key:
+                    yield previous[0]
+                    previous = next(old, None)
+                if previous is not None and previous[0] == record[0]:
+                    if previous[1:] != record[1:]:
+                        yield record[0]
+                    previous = next(old, None)
+                else:
+                    yield record[0]
+            while previous is not None:
+                yield previous[0]
+                previous = next(old, None)
+
+    """
+    Replace the snapshot with the one recorded by changes()
+    """
+
+    def commit(self, started):
+        if os.path.exists(self.path + ".new"):
+            os.utime(self.path + ".new", (started, started))
+            os.replace(self.path + ".new", self.path)
+
+
+def read_journal(state_path, root, source, since):
+    """
+    Return the paths below source recorded by the watcher, relative to source,
+    or None when the journal is missing, incomplete or started after `since`
+    (the start of the last full pass) and the inventory must be used instead.
+    """
+    journal = os.path.join(state_path, JOURNAL)
+    if not os.path.exists(journal):
+        log.warning(f"No change journal found in {state_path}, is --watch running?")
+        return None
+    if os.path.exists(os.path.join(state_path, OVERFLOW)):
+        log.warning("The change journal overflowed and is incomplete")
+        return None
+
+    prefix = os.path.relpath(os.path.realpath(source), os.path.realpath(root))
+    if prefix.startswith(".."):
+        log.warning(f"{source} is outside of the watched directory {root}")
+        return None
+    changed = set()
+    with open(journal, "r") as f:
+        header = json.loads(f.readline() or "{}")
+        if since is None or header.get("started", float("inf")) > since:
+            log.warning("The change journal started after the last full pass and may miss changes")
+            return None
+        for line in f:
+            try:
+                path = json.loads(line)
+            except ValueError:
+                # Last line still being written by the watcher
+                continue
+            if prefix == ".":
+                changed.add(path)
+            elif path.startswith(prefix + "/"):
+                changed.add(path[len(prefix) + 1:])
+    return sorted(changed, key=path_key)
+
+
+class Watcher:
+    """
+    Record every path changed below root in the journal, using inotify watches on each directory.
+    """
+
+    def __init__(self, root, state_path):
+        self.root = os.path.realpath(root)
+        self.state_path = state_path
+        self.watches = {}
+        self.overflowed = False
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        os.makedirs(state_path, exist_ok=True)
+
+    def record(self, relative):
+        self.journal.write(json.dumps(relative) + "\n")
+
+    def overflow(self, reason):
+        if self.overflowed:
+            return
+        self.overflowed = True
+        log.error(f"Change journal incomplete ({reason}), the delta pass will use the inventory")
+        open(os.path.join(self.state_path, OVERFLOW), "w").close()
+
+    def add_watch(self, relative):
+        path = os.path.join(self.root, relative) if relative else self.root
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                self.overflow("inotify watch limit reached, raise fs.inotify.max_user_watches")
+            elif err not in (errno.ENOENT, errno.ENOTDIR):
+                log.warning(f"Failed to watch {path}: {os.strerror(err)}")
+            return
+        self.watches[wd] = relative
+
+    """
+    Watch a directory and everything already below it, recording the existing entries
+    when the directory appeared after the watcher started
+    """
+
+    def add_tree(self, relative, record=False):
+        self.add_watch(relative)
+        for child, info in walk(os.path.join(self.root, relative)):
+            path = f"{relative}/{child}" if relative else child
+            if record:
+                self.record(path)
+            if stat.S_ISDIR(info.st_mode):
+                self.add_watch(path)
+
+    def handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            self.overflow("inotify queue overflow")
+            return
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+        if wd not in self.watches:
+            return
+        parent = self.watches[wd]
+        relative = f"{parent}/{name}" if parent and name else name or parent
+        if relative:
+            self.record(relative)
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            self.add_tree(relative, record=True)
+
+    """
+    Watch the source until interrupted
+    """
+
+    def run(self):
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            log.error(f"Failed to initialize inotify: {os.strerror(ctypes.get_errno())}")
+            exit(1)
+        # A new watcher starts a new journal, changes before this point are covered by the inventory
+        overflow = os.path.join(self.state_path, OVERFLOW)
+        if os.path.exists(overflow):
+            os.remove(overflow)
+        self.journal = open(os.path.join(self.state_path, JOURNAL), "w")
+        self.journal.write(json.dumps({"started": time.time()}) + "\n")
+        try:
+            log.info(f"Adding inotify watches below {self.root}")
+            self.add_tree("")
+            self.journal.flush()
+            log.info(f"Watching {len(self.watches)} directories, recording changes in {self.journal.name}")
+            while True:
+                buffer = os.read(self.fd, 1024 * 1024)
+                offset = 0
+                while offset < len(buffer):
+                    wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+                    offset += EVENT_HEADER.size
+                    name = os.fsdecode(buffer[offset:offset + length].rstrip(b"\0"))
+                    offset += length
+                    self.handle(wd, mask, name)
+                self.journal.flush()
+        finally:
+            self.journal.close()
+            os.close(self.fd)
@@ -9,6 +9,68 @@ from rich import box
 import os
 
 
+"""
+NFS mount option profiles, applied as `mount -t nfs -o <options>`.
+Boolean values are written as bare flags (e.g. `nocto`), `None` or `False` are skipped.
+`nocto` and long `actimeo` are only safe because the source is read-only during the migration.
+"""
+NFS_PROFILES = {
+    "default": {},
+    "throughput": {
+        "vers": "4.2",
+        "nconnect": 8,
+        "rsize": 1048576,
+        "wsize": 1048576,
+        "actimeo": 600,
+        "nocto": True,
+    },
+    "metadata": {
+        "vers": "4.2",
+        "nconnect": 4,
+        "rsize": 262144,
+        "wsize": 262144,
+        "actimeo": 3600,
+        "nocto": True,
+    },
+    "v3-throughput": {
+        "vers": "3",
+        "proto": "tcp",
+        "nconnect": 8,
+        "rsize": 1048576,
+        "wsize": 1048576,
+        "actimeo": 600,
+        "nocto": True,
+    },
+}
+
+
+"""
+SSHFS performance profiles, added to the `options` of the source as `-o <options>`.
+`max_conns` needs sshfs >= 3.7 and is dropped on older versions (sshfs 2.x is multithreaded already),
+`max_write` is only honoured by sshfs 2.x (libfuse 3 always uses 1MiB writes).
+"""
+SSHFS_PROFILES = {
+    "default": {},
+    "throughput": {
+        "Ciphers": "aes128-gcm@openssh.com",
+        "Compression": "no",
+        "max_read": 1048576,
+        "max_write": 1048576,
+        "kernel_cache": True,
+        "max_conns": 4,
+    },
+    "metadata": {
+        "Ciphers": "aes128-gcm@openssh.com",
+        "Compression": "no",
+        "kernel_cache": True,
+        "cache_timeout": 3600,
+        "attr_timeout": 3600,
+        "entry_timeout": 3600,
+        "max_conns": 8,
+    },
+}
+
+
 class Config:
     """
     This class is responsible for loading and generating configuration files.
@@ -103,16 +165,25 @@ class Config:
                 "server": inquirer.prompt([inquirer.Text('server', default="x.x.x.x", message="Enter NFS source server")])['server'],
                 "serverPath": inquirer.prompt([inquirer.Text('serverPath', default="/srv/nfs/", message="Enter NFS server path")])['serverPath'],
                 "mountPath": inquirer.prompt([inquirer.Text('mountPath', default="/migration/source", message="Enter NFS mount path")])['mountPath'],
+                "options": dict(NFS_PROFILES[inquirer.prompt([inquirer.List('profile', message="Select NFS mount profile (use --tune-mount to benchmark them)", choices=list(NFS_PROFILES.keys()))])['profile']]),
             }
         elif source == "local":
-            return {
+            config = {
                 "type": "local",
                 "mountPath": inquirer.prompt([inquirer.Text('mountPath', default="/migration/source", message="Enter local source path")])['mountPath'],
             }
+            capture = inquirer.prompt([inquirer.List('changeCapture', message="Select change capture for --delta passes", choices=["none", "inventory", "inotify"])])['changeCapture']
+            if capture != "none":
+                config["changeCapture"] = {
+                    "type": capture,
+                    "path": inquirer.prompt([inquirer.Text('path', default="/migration/state", message="Enter change capture state path")])['path'],
+                }
+            return config
         elif source == "sshfs":
             return {
                 "type": "sshfs",
                 "options": inquirer.prompt([inquirer.Text('options', default="allow_other,allow_root,noauto_cache,reconnect", message="Enter SSHFS options")])['options'],
+                "profile": inquirer.prompt([inquirer.List('profile', message="Select SSHFS performance profile", choices=list(SSHFS_PROFILES.keys()))])['profile'],
                 "hosts": self.ask_hosts(),
                 "mountPath": inquirer.prompt([inquirer.Text('mountPath', default="/migration/source", message="Enter SSHFS mount path ($path + /$node)")])['mountPath'],
             }
@@ -154,10 +225,26 @@ class Config:
 
     def config_tools(self, copy_option):
         if copy_option == "rsync":
-            return {
+            config = {
                 "type": "rsync",
                 "options": inquirer.prompt([inquirer.Text('options', default="-aKhz", message="Enter rsync options")])['options']
             }
+            config["concurrency"] = {
+                "workers": inquirer.prompt([inquirer.Text('workers', default="1", message="Enter number of mapping entries migrated in parallel (auto to tune it from the throughput)")])['workers'],
+            }
+            if config["concurrency"]["workers"] != "auto":
+                config["concurrency"]["workers"] = int(config["concurrency"]["workers"])
+            per_device = inquirer.prompt([inquirer.Text('perDevice', default="", message="Enter maximum parallel entries per storage device (NFS server, disk, sshfs host), empty for no cap")])['perDevice']
+            if per_device:
+                config["concurrency"]["perDevice"] = int(per_device)
+            if inquirer.prompt([inquirer.List('batch', message="Stream the file list to rsync in batches (large trees)?", choices=["no", "yes"])])['batch'] == "yes":
+                config["batch"] = {
+                    "files": int(inquirer.prompt([inquirer.Text('files', default="10000", message="Enter maximum files per batch")])['files']),
+                    "bytes": int(inquirer.prompt([inquirer.Text('bytes', default=str(1024 * 1024 * 1024), message="Enter maximum bytes per batch")])['bytes']),
+                    "parallel": int(inquirer.prompt([inquirer.Text('parallel', default="1", message="Enter number of batches transferred in parallel")])['parallel']),
+                    "path": inquirer.prompt([inquirer.Text('path', default="/migration/state", message="Enter batch progress state path")])['path'],
+                }
+            return config
         else:
             log.error("Invalid copy option")
             exit(1)
@@ -277,6 +364,28 @@ class Config:
             if "ssh" not in self.config:
                 log.error("SSH configuration is missing")
                 exit(1)
+        if self.config["source"]["type"] == "sshfs" and self.config["source"].get("profile", "default") not in SSHFS_PROFILES:
+            log.error(f"Invalid SSHFS profile {self.config['source']['profile']}")
+            exit(1)
+        if "changeCapture" in self.config["source"]:
+            if self.config["source"]["type"] != "local":
+                log.error("Change capture is only supported for local sources")
+                exit(1)
+            if self.config["source"]["changeCapture"].get("type") not in ["inventory", "inotify"]:
+                log.error("Invalid change capture type")
+                exit(1)
+        concurrency = self.config["tools"].get("concurrency", {})
+        workers = concurrency.get("workers", 1)
+        if workers != "auto" and not str(workers).isdigit():
+            log.error(f"Invalid concurrency.workers {workers}, expected a number or auto")
+            exit(1)
+        # A cap below 1 would keep every entry on that device waiting forever
+        limits = {"perDevice": concurrency["perDevice"]} if concurrency.get("perDevice") is not None else {}
+        limits.update({f"devices.{device}": limit for device, limit in (concurrency.get("devices") or {}).items()})
+        for key, limit in limits.items():
+            if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+                log.error(f"Invalid concurrency.{key} {limit}, expected a number of at least 1")
+                exit(1)
         log.debug("Configuration is valid")
 
     """
@@ -286,6 +395,17 @@ class Config:
     def plain(self):
         return self.config
 
+    """
+    This method returns the source directory of a volume, SSHFS hosts are mounted in $path + /$node
+    """
+
+    def locate_source(self, source_dir, name):
+        if self.config["source"]["type"] == "sshfs":
+            for host in self.config["source"]["hosts"]:
+                if os.path.isdir(f"{source_dir}/{host['hostname']}/{name}"):
+                    return f"{source_dir}/{host['hostname']}/{name}"
+        return f"{source_dir}/{name}"
+
     """
     This method will ask the user to map the PVCs
     """
@@ -302,8 +422,8 @@ class Config:
                 for pvc in pvc_data:
                     # Check if the PVC is in the source directory
                     log.debug(
-                        f"Checking if source directory exists for {os.path.join(source_dir, pvc[type])}")
-                    if not os.path.isdir(f"{source_dir}/{pvc[type]}"):
+                        f"Checking if source directory exists for {self.locate_source(source_dir, pvc[type])}")
+                    if not os.path.isdir(self.locate_source(source_dir, pvc[type])):
                         log.error(
                             f"Source directory not found for {pvc['Name']}")
                         exit(1)
@@ -322,13 +442,13 @@ class Config:
                 f"Checking if destination directory exists for {os.path.join(dest_dir, pvc['Name'])}")
             if os.path.isdir(f"{dest_dir}/{pvc['Name']}"):
                 log.debug(f"Mapping {pvc[type]} to {pvc['Name']}")
-                if inquirer.prompt([inquirer.List('confirm', message=f"Confirm mapping for {source_dir}/{pvc[type]} ({pvc['Name']}) to {dest_dir}/{pvc['Name']}", choices=["yes", "no"])])['confirm'] == "yes":
+                if inquirer.prompt([inquirer.List('confirm', message=f"Confirm mapping for {self.locate_source(source_dir, pvc[type])} ({pvc['Name']}) to {dest_dir}/{pvc['Name']}", choices=["yes", "no"])])['confirm'] == "yes":
                     subpath = inquirer.prompt([inquirer.Checkbox(
                         'subpath', message=f"Select if subpath is activated ({pvc['Name']})", choices=["from", "to"])])['subpath']
                     mapping.append(
                         {
                             pvc['Name']: {
-                                "from": f"{source_dir}/{pvc[type]}" + ("/data" if "from" in subpath else ""),
+                                "from": f"{self.locate_source(source_dir, pvc[type])}" + ("/data" if "from" in subpath else ""),
                                 "to": f"{dest_dir}/{pvc['Name']}" + ("/data" if "to" in subpath else ""),
                             }
                         }
@@ -337,7 +457,7 @@ class Config:
                 log.warning(
                     f"Destination directory not found for {pvc['Name']}")
                 _input = inquirer.prompt([inquirer.Text(
-                    'confirm', message=f"Enter destination directory for {source_dir}/{pvc[type]} ({pvc['Name']}) (Empty to skip)")])['confirm']
+                    'confirm', message=f"Enter destination directory for {self.locate_source(source_dir, pvc[type])} ({pvc['Name']}) (Empty to skip)")])['confirm']
                 if _input:
                     if os.path.isdir(_input):
                         subpath = inquirer.prompt([inquirer.Checkbox(
@@ -345,7 +465,7 @@ class Config:
                         mapping.append(
                             {
                                 pvc['Name']: {
-                                    "from": f"{source_dir}/{pvc[[type]]}" + ("/data" if "from" in subpath else ""),
+                                    "from": f"{self.locate_source(source_dir, pvc[type])}" + ("/data" if "from" in subpath else ""),
                                     "to": _input + ("/data" if "to" in subpath else ""),
                                 }
 
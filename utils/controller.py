@@ -0,0 +1,177 @@
+from utils.logger import log
+from utils.profiler import children, read_proc, read_mountstats
+import os
+import threading
+import time
+
+# Seconds of traffic measured before each decision
+INTERVAL = 10.0
+# Relative throughput change considered an improvement or a drop
+GAIN = 0.05
+DROP = 0.10
+# NFS round-trip time, relative to the lowest observed, considered a latency spike
+LATENCY_SPIKE = 2.0
+# Multiplicative decrease factors
+BACKOFF = 0.5
+SETTLE = 0.75
+# Windows spent at a stable level before probing one more transfer
+PROBE_AFTER = 6
+
+
+class AdaptiveController:
+    """
+    Tune the number of concurrent transfers of a Scheduler from the observed throughput (AIMD):
+    add one transfer while the aggregate bytes/s improves, cut back multiplicatively when it drops,
+    flattens after an increase, or when the NFS round-trip time spikes.
+    """
+
+    def __init__(self, scheduler, mount_paths=(), start=1, maximum=16, interval=INTERVAL):
+        self.scheduler = scheduler
+        self.mount_paths = list(mount_paths)
+        self.minimum = 1
+        self.maximum = maximum
+        self.interval = interval
+        self.scheduler.set_limit(max(1, min(start, maximum)))
+
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.last = None
+        self.last_nfs = {}
+        self.previous = None
+        self.increased = False
+        self.settling = False
+        self.blocked = False
+        self.stable = 0
+        self.baseline_rtt = None
+        self.best = (0.0, self.scheduler.limit)
+
+    def transferred(self):
+        """
+        Bytes written by the transfer processes since the last call. Reaped children fold their counters
+        into their parent's, so our own counter plus the live descendants' keeps the bytes of the
+        transfers that finished during the interval.
+        """
+        total = read_proc(os.getpid())["wchar"]
+        for pid in children([os.getpid()]) - {os.getpid()}:
+            counters = read_proc(pid)
+            if counters is not None:
+                total += counters["wchar"]
+        delta = total - self.last if self.last is not None else 0
+        self.last = total
+        return max(delta, 0)
+
+    def rtt(self):
+        """Average NFS round-trip time in ms since the last call, or None without NFS traffic."""
+        stats = read_mountstats(self.mount_paths)
+        ops, rtt = 0, 0
+        for mount, counters in stats.items():
+            before = self.last_nfs.get(mount, {})
+            for op, values in counters.items():
+                ops += values[0] - before.get(op, (0,) * 5)[0]
+                rtt += values[3] - before.get(op, (0,) * 5)[3]
+        self.last_nfs = stats
+        return rtt / ops if ops else None
+
+    def set_limit(self, limit, reason):
+        limit = max(self.minimum, min(self.maximum, limit))
+        if limit != self.scheduler.limit:
+            log.info(
+                f"Adaptive concurrency: {self.scheduler.limit} -> {limit} transfers ({reason})")
+        self.settling = limit < self.scheduler.limit
+        self.scheduler.set_limit(limit)
+
+    """
+    Take one decision from the traffic of the last interval
+    """
+
+    def step(self, elapsed):
+        rate = self.transferred() / elapsed
+        rtt = self.rtt()
+        limit = self.scheduler.limit
+        log.debug(
+            f"Adaptive concurrency: {rate / 1024 / 1024:.1f} MiB/s with {self.scheduler.running}/{limit} transfers, rtt {rtt if rtt is not None else '-'} ms")
+
+        blocked = False
+        if self.scheduler.running < limit:
+            if not self.scheduler.waiting():
+                # The queue is draining, a level is only judged once it is actually used
+                self.previous = None
+                return
+            # Entries are waiting on per-device caps, judge the level that actually runs
+            blocked = True
+            if not self.blocked:
+                log.info(
+                    f"Adaptive concurrency: per-device caps hold the migration at {self.scheduler.running}/{limit} transfers")
+            limit = self.scheduler.running
+        self.blocked = blocked
+        # A decrease only applies once enough transfers finished
+        if self.scheduler.running > limit:
+            return
+        if rate > self.best[0]:
+            self.best = (rate, limit)
+        if rtt is not None:
+            self.baseline_rtt = rtt if self.baseline_rtt is None else min(self.baseline_rtt, rtt)
+        if self.settling:
+            # Measure the level reached after a decrease before comparing anything to it
+            self.previous = rate
+            self.settling = False
+            return
+        if self.previous is None:
+            self.previous = rate
+            if not blocked:
+                self.set_limit(limit + 1, "probing")
+                self.increased = True
+            return
+
+        spike = rtt is not None and self.baseline_rtt and rtt > self.baseline_rtt * LATENCY_SPIKE
+        if spike:
+            self.set_limit(int(limit * BACKOFF),
+                           f"nfs rtt {rtt:.1f} ms, baseline {self.baseline_rtt:.1f} ms")
+            self.increased = False
+        elif rate < self.previous * (1 - DROP):
+            self.set_limit(int(limit * BACKOFF),
+                           f"throughput dropped to {rate / 1024 / 1024:.1f} MiB/s")
+            self.increased = False
+        elif blocked:
+            # More transfers could not start anyway, keep the current limit
+            self.increased = False
+        elif rate > self.previous * (1 + GAIN):
+            self.set_limit(limit + 1,
+                           f"throughput improved to {rate / 1024 / 1024:.1f} MiB/s")
+            self.increased = True
+            self.stable = 0
+        elif self.increased:
+            self.set_limit(int(limit * SETTLE), "throughput flattened")
+            self.increased = False
+            self.stable = 0
+        else:
+            self.stable += 1
+            if self.stable >= PROBE_AFTER:
+                self.set_limit(limit + 1, "probing")
+                self.increased = True
+                self.stable = 0
+        self.previous = rate
+
+    def loop(self):
+        previous = time.monotonic()
+        # Start counting from the processes already running
+        self.transferred()
+        self.rtt()
+        while not self.stop_event.wait(self.interval):
+            now = time.monotonic()
+            self.step(now - previous)
+            previous = now
+
+    def start(self):
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        rate, limit = self.best
+        if rate:
+            log.info(
+                f"Adaptive concurrency: best throughput {rate / 1024 / 1024:.1f} MiB/s with {limit} transfers, set tools.concurrency.workers to {limit} to reuse it")
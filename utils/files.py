@@ -0,0 +1,105 @@
+import json
+import os
+import re
+import stat
+import threading
+
+# Default directory holding inventories, the inotify journal, file lists and batch progress
+STATE_PATH = "/migration/state"
+# Default bounds of a batch streamed to rsync
+BATCH_FILES = 10000
+BATCH_BYTES = 1024 * 1024 * 1024
+
+
+def state_file(state_path, name, suffix):
+    """Return the path of a per-mapping state file."""
+    return os.path.join(state_path, re.sub(r"[^A-Za-z0-9_.-]", "_", name.strip("/")) + suffix)
+
+
+def walk(root):
+    """
+    Lazily walk root depth-first, yielding (relative_path, stat) for every entry below it.
+    Entries are sorted by name in each directory so two walks of the same tree yield the same order,
+    which is the order of path_key. Sorting holds the listing of every directory on the current path
+    in memory, so a huge flat directory costs memory proportional to its size. Symlinks are not followed.
+    """
+    stack = [("", None)]
+    while stack:
+        relative, entries = stack.pop()
+        if entries is None:
+            try:
+                with os.scandir(os.path.join(root, relative)) as it:
+                    entries = iter(sorted(it, key=lambda e: e.name))
+            except OSError:
+                continue
+        for entry in entries:
+            path = f"{relative}/{entry.name}" if relative else entry.name
+            try:
+                stat = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            yield path, stat
+            if entry.is_dir(follow_symlinks=False):
+                # Resume this directory after its child is fully walked
+                stack.append((relative, entries))
+                stack.append((path, None))
+                break
+
+
+def path_key(path):
+    """Sort key matching the order in which walk yields paths."""
+    return path.split("/")
+
+
+def batches(root, max_files=BATCH_FILES, max_bytes=BATCH_BYTES):
+    """
+    Lazily split the entries of root into batches of at most max_files entries or max_bytes of regular file data,
+    yielding (index, paths, size). Only the current batch, and the listings walk holds, are kept in memory.
+    """
+    index, paths, size = 0, [], 0
+    for path, info in walk(root):
+        length = info.st_size if stat.S_ISREG(info.st_mode) else 0
+        if paths and (len(paths) >= max_files or size + length > max_bytes):
+            yield index, paths, size
+            index, paths, size = index + 1, [], 0
+        paths.append(path)
+        size += length
+    if paths:
+        yield index, paths, size
+
+
+class BatchProgress:
+    """
+    Completed batches of a mapping entry, so an interrupted migration resumes after the last finished batch.
+    A batch is only skipped when its first path, last path and length still match, i.e. the tree did not shift.
+    """
+
+    def __init__(self, state_path, name):
+        self.path = state_file(state_path, name, ".batches")
+        os.makedirs(state_path, exist_ok=True)
+        self.completed = {}
+        self.lock = threading.Lock()
+        try:
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.completed[record["index"]] = record["fingerprint"]
+        except FileNotFoundError:
+            pass
+
+    def fingerprint(self, paths):
+        return [paths[0], paths[-1], len(paths)]
+
+    def done(self, index, paths):
+        return self.completed.get(index) == self.fingerprint(paths)
+
+    def record(self, index, paths):
+        with self.lock, open(self.path, "a") as f:
+            f.write(json.dumps({"index": index, "fingerprint": self.fingerprint(paths)}) + "\n")
+
+    def reset(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,278 @@
+from utils.logger import log
+from functools import lru_cache
+import json
+import os
+import re
+import threading
+import time
+
+# Seconds between two samples
+INTERVAL = 1.0
+# Thresholds used to name the bottleneck of a transfer
+CPU_BOUND = 85.0
+IOWAIT_BOUND = 50.0
+NFS_LATENCY_BOUND = 10.0
+
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+TASK_DELAYACCT = "/proc/sys/kernel/task_delayacct"
+
+
+@lru_cache(maxsize=None)
+def delayacct_enabled():
+    """
+    Whether the kernel records block I/O delays (delayacct_blkio_ticks), off by default since Linux 5.14.
+    The setting is host-wide, so it is only reported, never changed.
+    """
+    try:
+        with open(TASK_DELAYACCT, "r") as f:
+            enabled = f.read().strip() != "0"
+    except OSError:
+        # Older kernels without the sysctl always account delays
+        return True
+    if not enabled:
+        log.warning(
+            "kernel.task_delayacct is off, I/O wait is not measured and source/destination bottlenecks cannot be detected (sysctl kernel.task_delayacct=1 to enable it)")
+    return enabled
+
+
+def read_proc(pid):
+    """Return the I/O and CPU counters of a process, or None once it exited."""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            # The command name may contain spaces, fields start after its closing parenthesis
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/io", "r") as f:
+            io = {key: int(value) for key, value in (
+                line.split(": ") for line in f.read().splitlines())}
+    except (OSError, IndexError, ValueError):
+        return None
+    return {
+        "ppid": int(fields[1]),
+        # utime + stime, in clock ticks
+        "cpu": int(fields[11]) + int(fields[12]),
+        # delayacct_blkio_ticks, time spent waiting for block I/O
+        "iowait": int(fields[39]) if len(fields) > 39 else 0,
+        "rchar": io.get("rchar", 0),
+        "wchar": io.get("wchar", 0),
+        "read_bytes": io.get("read_bytes", 0),
+        "write_bytes": io.get("write_bytes", 0),
+    }
+
+
+def children(pids):
+    """Return pids and all their descendants."""
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                parents[int(entry)] = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    tree = set(pids)
+    changed = True
+    while changed:
+        changed = False
+        for pid, ppid in parents.items():
+            if ppid in tree and pid not in tree:
+                tree.add(pid)
+                changed = True
+    return tree
+
+
+def read_mountstats(mount_paths):
+    """
+    Return the cumulative NFS per-operation counters of the given mount points:
+    {mount: {op: (ops, bytes_sent, bytes_recv, rtt_ms, execute_ms)}}
+    """
+    mount_paths = {os.path.realpath(path) for path in mount_paths}
+    stats = {}
+    current = None
+    try:
+        with open("/proc/self/mountstats", "r") as f:
+            for line in f:
+                match = re.match(r"^device \S+ mounted on (\S+) with fstype (\S+)", line)
+                if match:
+                    current = match.group(1) if match.group(
+                        1) in mount_paths and match.group(2).startswith("nfs") else None
+                    if current:
+                        stats[current] = {}
+                    continue
+                if current is None:
+                    continue
+                match = re.match(r"^\s+([A-Z_]+): ((?:\d+ ?){8,})$", line)
+                if match:
+                    values = [int(v) for v in match.group(2).split()]
+                    # ops trans timeouts bytes_sent bytes_recv queue rtt execute
+                    stats[current][match.group(1)] = (
+                        values[0], values[3], values[4], values[6], values[7])
+    except OSError:
+        pass
+    return stats
+
+
+class Profiler:
+    """
+    Sample the transfer processes and the NFS mounts they use, write a timeline and a bottleneck summary.
+    """
+
+    def __init__(self, name, path, mount_paths=(), interval=INTERVAL):
+        self.name = name
+        self.interval = interval
+        self.mount_paths = list(mount_paths)
+        self.roots = set()
+        os.makedirs(path, exist_ok=True)
+        safe = re.sub(r"[^A-Za-z0-9_.-]", "_", name.strip("/"))
+        self.timeline_path = os.path.join(path, f"{safe}.timeline.jsonl")
+        self.summary_path = os.path.join(path, f"{safe}.summary.json")
+
+        self.delayacct = delayacct_enabled()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.last = {}
+        self.last_nfs = {}
+        self.samples = []
+
+    """
+    Follow a transfer process and its children
+    """
+
+    def add(self, pid):
+        with self.lock:
+            self.roots.add(pid)
+            # Parallel batches share a profiler, only the first one starts sampling
+            if self.thread is None:
+                self.last_nfs = read_mountstats(self.mount_paths)
+                self.started = time.monotonic()
+                self.timeline = open(self.timeline_path, "w")
+                self.thread = threading.Thread(target=self.loop, daemon=True)
+                self.thread.start()
+
+    def loop(self):
+        previous = time.monotonic()
+        while not self.stop_event.wait(self.interval):
+            now = time.monotonic()
+            self.sample(now - previous, now)
+            previous = now
+
+    def sample(self, elapsed, now):
+        with self.lock:
+            roots = set(self.roots)
+        pids = children(roots)
+        totals = {"rchar": 0, "wchar": 0, "read_bytes": 0,
+                  "write_bytes": 0, "cpu": 0, "iowait": 0}
+        busiest, read_wait, write_wait = 0.0, 0, 0
+        current = {}
+        for pid in pids:
+            counters = read_proc(pid)
+            if counters is None:
+                continue
+            current[pid] = counters
+            previous = self.last.get(pid, {})
+            delta = {key: counters[key] - previous.get(key, 0) for key in totals}
+            for key in totals:
+                totals[key] += delta[key]
+            busiest = max(busiest, delta["cpu"] / CLK_TCK / elapsed * 100)
+            # rsync runs the sender (reading the source) in the process we started,
+            # and forks the generator and receiver (writing the destination)
+            if pid in roots:
+                read_wait += delta["iowait"]
+            else:
+                write_wait += delta["iowait"]
+        self.last = current
+
+        nfs = {}
+        stats = read_mountstats(self.mount_paths)
+        for mount, ops in stats.items():
+            before = self.last_nfs.get(mount, {})
+            count = sum(v[0] - before.get(op, (0,) * 5)[0] for op, v in ops.items())
+            rtt = sum(v[3] - before.get(op, (0,) * 5)[3] for op, v in ops.items())
+            sent = sum(v[1] - before.get(op, (0,) * 5)[1] for op, v in ops.items())
+            received = sum(v[2] - before.get(op, (0,) * 5)[2] for op, v in ops.items())
+            nfs[mount] = {
+                "ops_s": count / elapsed,
+                "rtt_ms": rtt / count if count else 0.0,
+                "sent_bytes_s": sent / elapsed,
+                "recv_bytes_s": received / elapsed,
+            }
+        self.last_nfs = stats
+
+        sample = {
+            "time": round(now - self.started, 3),
+            "processes": len(current),
+            "read_bytes_s": totals["rchar"] / elapsed,
+            "write_bytes_s": totals["wchar"] / elapsed,
+            "disk_read_bytes_s": totals["read_bytes"] / elapsed,
+            "disk_write_bytes_s": totals["write_bytes"] / elapsed,
+            "cpu_percent": totals["cpu"] / CLK_TCK / elapsed * 100,
+            "busiest_cpu_percent": busiest,
+            "iowait_percent": totals["iowait"] / CLK_TCK / elapsed * 100,
+            "read_iowait_percent": read_wait / CLK_TCK / elapsed * 100,
+            "write_iowait_percent": write_wait / CLK_TCK / elapsed * 100,
+            "nfs": nfs,
+        }
+        self.samples.append(sample)
+        self.timeline.write(json.dumps(sample) + "\n")
+        self.timeline.flush()
+
+    """
+    Name the resource that limited the transfer from the averaged samples
+    """
+
+    def summary(self):
+        def average(key):
+            return sum(s[key] for s in self.samples) / len(self.samples) if self.samples else 0.0
+
+        latency = {}
+        for sample in self.samples:
+            for mount, stats in sample["nfs"].items():
+                if stats["ops_s"]:
+                    latency.setdefault(mount, []).append(stats["rtt_ms"])
+        latency = {mount: sum(v) / len(v) for mount, v in latency.items()}
+        slowest = max(latency, key=latency.get) if latency else None
+
+        if average("busiest_cpu_percent") >= CPU_BOUND:
+            bottleneck = "rsync cpu"
+        elif slowest and latency[slowest] >= NFS_LATENCY_BOUND:
+            bottleneck = f"nfs latency ({slowest})"
+        elif not self.delayacct:
+            bottleneck = "unknown (enable kernel.task_delayacct to measure I/O wait)"
+        elif average("read_iowait_percent") >= IOWAIT_BOUND:
+            bottleneck = "source read"
+        elif average("write_iowait_percent") >= IOWAIT_BOUND:
+            bottleneck = "destination write"
+        else:
+            bottleneck = "network or remote latency"
+
+        return {
+            "name": self.name,
+            "samples": len(self.samples),
+            "duration_s": round(time.monotonic() - self.started, 3),
+            "read_bytes_s": average("read_bytes_s"),
+            "write_bytes_s": average("write_bytes_s"),
+            "cpu_percent": average("cpu_percent"),
+            "busiest_cpu_percent": average("busiest_cpu_percent"),
+            "iowait_percent": average("iowait_percent"),
+            "nfs_rtt_ms": latency,
+            "bottleneck": bottleneck,
+            "timeline": self.timeline_path,
+        }
+
+    """
+    Stop sampling and write the summary
+    """
+
+    def stop(self):
+        if self.thread is None:
+            return None
+        self.stop_event.set()
+        self.thread.join()
+        self.timeline.close()
+        summary = self.summary()
+        with open(self.summary_path, "w") as f:
+            json.dump(summary, f, indent=2)
+        log.info(
+            f"[{self.name}] Profile: {summary['read_bytes_s'] / 1024 / 1024:.1f} MiB/s read, {summary['write_bytes_s'] / 1024 / 1024:.1f} MiB/s write, {summary['cpu_percent']:.0f}% cpu, {summary['iowait_percent']:.0f}% iowait, bottleneck: {summary['bottleneck']}")
+        return summary
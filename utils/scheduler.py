@@ -0,0 +1,113 @@
+from utils.logger import log
+import threading
+
+
+class Scheduler:
+    """
+    Run tasks concurrently, at most `limit` at once and at most `device_limits[key]` (or `per_device`)
+    at once on each storage device a task touches. A task waiting for a busy device does not hold back
+    the tasks queued behind it.
+    """
+
+    def __init__(self, limit=1, per_device=None, device_limits=None):
+        self.limit = limit
+        self.per_device = per_device
+        self.device_limits = device_limits or {}
+        self.condition = threading.Condition()
+        self.busy = {}
+        self.running = 0
+        self.pending = []
+        self.errors = []
+
+    def device_limit(self, device):
+        return self.device_limits.get(device, self.per_device)
+
+    """
+    Change the number of concurrent tasks, takes effect as soon as a slot frees up
+    """
+
+    def set_limit(self, limit):
+        with self.condition:
+            self.limit = limit
+            self.condition.notify_all()
+
+    def available(self, devices):
+        if self.running >= self.limit:
+            return False
+        for device in devices:
+            limit = self.device_limit(device)
+            if limit is not None and self.busy.get(device, 0) >= limit:
+                return False
+        return True
+
+    def execute(self, name, devices, function):
+        try:
+            function()
+        except BaseException as e:
+            # migrate_rsync exits on failure, keep it to re-raise once the running tasks are done
+            with self.condition:
+                self.errors.append((name, e))
+        finally:
+            with self.condition:
+                self.running -= 1
+                for device in devices:
+                    self.busy[device] -= 1
+                self.condition.notify_all()
+
+    """
+    Return how many of the (name, devices, ...) tasks the device caps let run at once, and the devices at their cap
+    """
+
+    def reachable(self, tasks):
+        busy = {}
+        count = 0
+        for task in tasks:
+            devices = task[1]
+            if all(self.device_limit(d) is None or busy.get(d, 0) < self.device_limit(d) for d in devices):
+                count += 1
+                for device in devices:
+                    busy[device] = busy.get(device, 0) + 1
+        full = sorted(d for d, n in busy.items() if self.device_limit(d) is not None and n >= self.device_limit(d))
+        return count, full
+
+    """
+    Whether tasks are queued but held back, by device caps when slots are free
+    """
+
+    def waiting(self):
+        with self.condition:
+            return bool(self.pending)
+
+    """
+    Run (name, devices, function) tasks until all are done, or until one fails
+    """
+
+    def run(self, tasks):
+        self.pending = pending = list(tasks)
+        threads = []
+        with self.condition:
+            while pending and not self.errors:
+                task = next((t for t in pending if self.available(t[1])), None)
+                if task is None:
+                    if self.running == 0:
+                        # Nothing will free a slot, the remaining tasks can never start
+                        names = ", ".join(t[0] for t in pending)
+                        raise RuntimeError(f"No task can start with the current limits: {names}")
+                    self.condition.wait()
+                    continue
+                pending.remove(task)
+                name, devices, function = task
+                self.running += 1
+                for device in devices:
+                    self.busy[device] = self.busy.get(device, 0) + 1
+                log.debug(f"[{name}] Starting on {', '.join(sorted(devices))} ({self.running}/{self.limit} running)")
+                thread = threading.Thread(target=self.execute, args=(
+                    name, devices, function), daemon=True)
+                threads.append(thread)
+                thread.start()
+        for thread in threads:
+            thread.join()
+        if self.errors:
+            name, error = self.errors[0]
+            log.error(f"[{name}] Transfer failed, {len(pending)} entries not started")
+            raise error